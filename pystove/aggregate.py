@@ -0,0 +1,254 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+from collections import deque
+import time
+
+from . import const as c
+
+STAT_COUNT = "count"
+STAT_MAX = "max"
+STAT_MEAN = "mean"
+STAT_MIN = "min"
+STAT_START = "start"
+
+# Metric: (low, high) range of the percentile histogram
+METRICS = {
+    c.DATA_STOVE_TEMPERATURE: (0, 1000),
+    c.DATA_OXYGEN_LEVEL: (0, 25),
+    c.DATA_VALVE1_POSITION: (0, 100),
+    c.DATA_VALVE2_POSITION: (0, 100),
+    c.DATA_VALVE3_POSITION: (0, 100),
+}
+
+# Window span in seconds
+WINDOWS = (60, 900, 3600)
+
+# (resolution in seconds, number of points to retain)
+RESOLUTIONS = ((60, 1440), (900, 672), (3600, 8760))
+
+
+class _Bucket:
+    """Statistics of the values in one time slot."""
+
+    def __init__(self, bins):
+        self.slot = None
+        self.histogram = [0] * bins
+        self.clear(None)
+
+    def clear(self, slot):
+        self.slot = slot
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        for i in range(len(self.histogram)):
+            self.histogram[i] = 0
+
+    def add(self, value, bin_index):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.histogram[bin_index] += 1
+
+
+class RollingWindow:
+    """Rolling statistics of the values added during the last span seconds.
+
+    The window is divided into a fixed number of time buckets, so memory
+    use is bounded and adding a value takes constant time. Percentiles are
+    estimated from a fixed histogram between low and high.
+    """
+
+    def __init__(self, span, buckets=60, low=0, high=100, bins=100):
+        """Initialize the window."""
+        self.span = span
+        self.low = low
+        self.high = high
+        self._width = span / buckets
+        self._bin_width = (high - low) / bins
+        self._buckets = [_Bucket(bins) for _ in range(buckets)]
+
+    def add(self, value, timestamp=None):
+        """Add a value observed at timestamp (defaults to now)."""
+        if timestamp is None:
+            timestamp = time.time()
+        slot = int(timestamp // self._width)
+        bucket = self._buckets[slot % len(self._buckets)]
+        if bucket.slot != slot:
+            bucket.clear(slot)
+        bin_index = int((value - self.low) / self._bin_width)
+        bin_index = min(max(bin_index, 0), len(bucket.histogram) - 1)
+        bucket.add(value, bin_index)
+
+    def stats(self, percentiles=(50, 90, 99), timestamp=None):
+        """Return count, mean, min, max and percentiles of the window.
+
+        Percentiles are returned with keys like "p50". Returns None if
+        the window is empty.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        current = int(timestamp // self._width)
+        live = [
+            b
+            for b in self._buckets
+            if b.count and current - len(self._buckets) < b.slot <= current
+        ]
+        count = sum(b.count for b in live)
+        if not count:
+            return None
+        result = {
+            STAT_COUNT: count,
+            STAT_MEAN: sum(b.total for b in live) / count,
+            STAT_MIN: min(b.min for b in live),
+            STAT_MAX: max(b.max for b in live),
+        }
+        histogram = [
+            sum(column) for column in zip(*(b.histogram for b in live), strict=True)
+        ]
+        for p in percentiles:
+            result[f"p{p}"] = min(
+                max(self._percentile(histogram, count, p), result[STAT_MIN]),
+                result[STAT_MAX],
+            )
+        return result
+
+    def _percentile(self, histogram, count, p):
+        rank = count * p / 100
+        seen = 0
+        for i, n in enumerate(histogram):
+            if n and seen + n >= rank:
+                return self.low + (i + (rank - seen) / n) * self._bin_width
+            seen += n
+        return self.high
+
+
+class Downsampler:
+    """Fixed resolution summaries of a series for long term retention.
+
+    For every (resolution, retain) pair the last retain completed periods
+    of resolution seconds are kept as dicts with start, count, mean, min
+    and max.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        """Initialize the downsampler."""
+        self._series = {
+            resolution: (deque(maxlen=retain), _Bucket(0))
+            for resolution, retain in resolutions
+        }
+
+    def add(self, value, timestamp=None):
+        """Add a value observed at timestamp (defaults to now)."""
+        if timestamp is None:
+            timestamp = time.time()
+        for resolution, (history, bucket) in self._series.items():
+            slot = int(timestamp // resolution)
+            if bucket.slot != slot:
+                if bucket.count:
+                    history.append(self._summary(bucket, resolution))
+                bucket.clear(slot)
+            bucket.count += 1
+            bucket.total += value
+            bucket.min = value if bucket.min is None else min(bucket.min, value)
+            bucket.max = value if bucket.max is None else max(bucket.max, value)
+
+    def history(self, resolution, include_current=False):
+        """Return the retained summaries at resolution, oldest first."""
+        history, bucket = self._series[resolution]
+        result = list(history)
+        if include_current and bucket.count:
+            result.append(self._summary(bucket, resolution))
+        return result
+
+    @staticmethod
+    def _summary(bucket, resolution):
+        return {
+            STAT_START: bucket.slot * resolution,
+            STAT_COUNT: bucket.count,
+            STAT_MEAN: bucket.total / bucket.count,
+            STAT_MIN: bucket.min,
+            STAT_MAX: bucket.max,
+        }
+
+
+class TelemetryAggregator:
+    """Rolling windows and downsampled history of one stove's telemetry."""
+
+    def __init__(self, windows=WINDOWS, resolutions=RESOLUTIONS, metrics=METRICS):
+        """Initialize the aggregator."""
+        self.windows = {
+            metric: {span: RollingWindow(span, low=low, high=high) for span in windows}
+            for metric, (low, high) in metrics.items()
+        }
+        self.downsamplers = {metric: Downsampler(resolutions) for metric in metrics}
+
+    def add(self, metric, value, timestamp=None):
+        """Add a single metric value."""
+        if timestamp is None:
+            timestamp = time.time()
+        for window in self.windows[metric].values():
+            window.add(value, timestamp)
+        self.downsamplers[metric].add(value, timestamp)
+
+    def update(self, data, timestamp=None):
+        """Add the metrics in a Stove.get_data result."""
+        for metric in self.windows:
+            if data.get(metric) is not None:
+                self.add(metric, data[metric], timestamp)
+
+    def update_live(self, live_data, timestamp=None):
+        """Add the most recent point of a Stove.get_live_data result."""
+        if not live_data:
+            return
+        for metric in (c.DATA_STOVE_TEMPERATURE, c.DATA_OXYGEN_LEVEL):
+            if metric in self.windows and live_data.get(metric):
+                self.add(metric, live_data[metric][-1], timestamp)
+
+    def stats(self, metric, span, percentiles=(50, 90, 99), timestamp=None):
+        """Return the statistics of metric over the window of span seconds."""
+        return self.windows[metric][span].stats(percentiles, timestamp)
+
+    def history(self, metric, resolution, include_current=False):
+        """Return the downsampled history of metric."""
+        return self.downsamplers[metric].history(resolution, include_current)
+
+
+class FleetAggregator:
+    """TelemetryAggregator per stove host."""
+
+    def __init__(self, **kwargs):
+        """Initialize, kwargs are passed to every TelemetryAggregator."""
+        self._kwargs = kwargs
+        self.stoves = {}
+
+    def __getitem__(self, host):
+        """Return the aggregator of host, creating it if needed."""
+        if host not in self.stoves:
+            self.stoves[host] = TelemetryAggregator(**self._kwargs)
+        return self.stoves[host]
+
+    def update(self, host, data, timestamp=None):
+        """Add a Stove.get_data result of host."""
+        self[host].update(data, timestamp)
+
+    def update_live(self, host, live_data, timestamp=None):
+        """Add a Stove.get_live_data result of host."""
+        self[host].update_live(live_data, timestamp)
@@ -0,0 +1,153 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+from datetime import timedelta
+
+from . import const as c
+
+
+class _RunningStats:
+    """Count, mean, min and max of a series in constant memory."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        if self.count == 1:
+            self.mean = self.min = self.max = value
+            return
+        self.mean += (value - self.mean) / self.count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+
+class BurnCycle:
+    """Summary of a single burn cycle, from ignition until standby."""
+
+    def __init__(self, start, partial=False):
+        """Initialize a cycle starting at start.
+
+        A partial cycle was already running when tracking started.
+        """
+        self.start = start
+        self.partial = partial
+        self.end = None
+        self.ignition_duration = None
+        self.phase_durations = {phase: timedelta() for phase in c.BurnPhase}
+        self.refuels = 0
+        self.refill_alarms = 0
+        self.samples = 0
+        self.stove_temperature = _RunningStats()
+        self.oxygen_level = _RunningStats()
+
+    @property
+    def duration(self):
+        """Return the duration of a finished cycle."""
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def __repr__(self):
+        return (
+            f"<BurnCycle start={self.start} end={self.end}"
+            f" ignition_duration={self.ignition_duration}"
+            f" refuels={self.refuels} refill_alarms={self.refill_alarms}"
+            f" max_temperature={self.stove_temperature.max}>"
+        )
+
+
+class BurnCycleTracker:
+    """Incremental burn cycle detection for a single stove.
+
+    Feed successive Stove.get_data results to update(). Every update
+    takes constant time and only the running summary of the current
+    cycle is kept. A cycle starts when the stove enters the ignition
+    phase from standby and ends when it returns to standby. Returning
+    to ignition during a cycle counts as a refuel.
+    """
+
+    def __init__(self):
+        """Initialize the tracker."""
+        self.current = None
+        self.cycles_completed = 0
+        self._phase = None
+        self._refill_alarm = False
+        self._timestamp = None
+
+    def update(self, data):
+        """Process a get_data result, return a BurnCycle when one ended."""
+        phase = data[c.DATA_PHASE]
+        timestamp = data[c.DATA_DATE_TIME]
+        refill_alarm = bool(data[c.DATA_REFILL_ALARM])
+        finished = None
+        cycle = self.current
+
+        if cycle is not None and self._timestamp is not None:
+            elapsed = timestamp - self._timestamp
+            if elapsed > timedelta():
+                cycle.phase_durations[self._phase] += elapsed
+
+        if phase == c.BurnPhase.STANDBY:
+            if cycle is not None:
+                cycle.end = timestamp
+                finished = cycle
+                self.current = cycle = None
+                self.cycles_completed += 1
+        elif cycle is None:
+            self.current = cycle = BurnCycle(
+                timestamp, partial=phase != c.BurnPhase.IGNITION
+            )
+        elif phase == c.BurnPhase.IGNITION and self._phase != c.BurnPhase.IGNITION:
+            cycle.refuels += 1
+
+        if cycle is not None:
+            if (
+                not cycle.partial
+                and cycle.ignition_duration is None
+                and phase != c.BurnPhase.IGNITION
+            ):
+                cycle.ignition_duration = timestamp - cycle.start
+            if refill_alarm and not self._refill_alarm:
+                cycle.refill_alarms += 1
+            self.add_sample(data[c.DATA_STOVE_TEMPERATURE], data[c.DATA_OXYGEN_LEVEL])
+
+        self._phase = phase
+        self._refill_alarm = refill_alarm
+        self._timestamp = timestamp
+        return finished
+
+    def add_sample(self, stove_temperature, oxygen_level):
+        """Add a temperature and oxygen sample to the current cycle."""
+        if self.current is None:
+            return
+        self.current.samples += 1
+        self.current.stove_temperature.add(stove_temperature)
+        self.current.oxygen_level.add(oxygen_level)
+
+    def update_live(self, live_data, new_samples=1):
+        """Add the last new_samples points of a get_live_data result."""
+        if not live_data or new_samples <= 0:
+            return
+        temperatures = live_data[c.DATA_STOVE_TEMPERATURE][-new_samples:]
+        oxygen_levels = live_data[c.DATA_OXYGEN_LEVEL][-new_samples:]
+        for temperature, oxygen in zip(temperatures, oxygen_levels, strict=True):
+            self.add_sample(temperature, oxygen)
@@ -0,0 +1,80 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+
+from .pystove import FIELD_CONVERTERS
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def read_payloads(source):
+    """Yield raw payloads from a file with one JSON document per line.
+
+    Source can be a path or an open text file. Blank lines are skipped.
+    """
+    if isinstance(source, str):
+        with open(source, encoding="utf-8") as f:
+            yield from read_payloads(f)
+        return
+    for line_no, line in enumerate(source, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as exc:
+            _LOGGER.error("Skipping invalid payload on line %d: %s", line_no, exc.msg)
+
+
+def process_batch(payloads):
+    """Process raw payloads into columnar form.
+
+    Returns a dict mapping each key of Stove.get_data to a list with one
+    value per payload, in input order. Empty payloads (failed reads) are
+    skipped. The conversions are applied per column instead of per payload.
+    """
+    payloads = [p for p in payloads if p]
+    if not payloads:
+        return {}
+    result = {}
+    for key, (convert, keys) in FIELD_CONVERTERS.items():
+        columns = [[p[k] for p in payloads] for k in keys]
+        result[key] = columns[0] if convert is None else list(map(convert, *columns))
+    return result
+
+
+def process_file(source):
+    """Process all payloads in a file, return columnar result."""
+    return process_batch(read_payloads(source))
+
+
+def process_files(paths, max_workers=None):
+    """Process payload files in parallel using a process pool.
+
+    Returns the columnar results of all files concatenated in the order of
+    paths. max_workers defaults to the number of CPUs.
+    """
+    result = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for columns in executor.map(process_file, paths):
+            for key, values in columns.items():
+                result.setdefault(key, []).extend(values)
+    return result
@@ -0,0 +1,122 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from . import const as c
+from .pystove import Stove, pack_blocks
+from .transport import HttpTransport
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class BroadcastReport:
+    """Summary of a file broadcast."""
+
+    def __init__(self):
+        """Initialize an empty report."""
+        self.succeeded = []
+        self.failed = {}
+        self.attempts = {}
+        self.bytes_sent = 0
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        """Return the number of bytes written per second."""
+        if not self.elapsed:
+            return 0.0
+        return self.bytes_sent / self.elapsed
+
+    def __repr__(self):
+        return (
+            f"<BroadcastReport succeeded={len(self.succeeded)}"
+            f" failed={len(self.failed)} bytes_sent={self.bytes_sent}"
+            f" elapsed={self.elapsed:.2f}s throughput={self.throughput:.0f}B/s>"
+        )
+
+
+async def broadcast_file(
+    hosts,
+    filename,
+    data,
+    concurrency=16,
+    retries=2,
+    retry_delay=1.0,
+    transport=None,
+):
+    """Write the same file to many stoves, return a BroadcastReport.
+
+    Data can be bytes or str, str is written UTF-8 encoded. The data is
+    packed once and the packed blocks are reused for every host. At most
+    concurrency uploads run at the same time and a failed upload is
+    retried up to retries times, retry_delay seconds apart.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    blocks = pack_blocks(data)
+    report = BroadcastReport()
+    own_transport = transport is None
+    if own_transport:
+        transport = HttpTransport()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def upload(host):
+        async with semaphore:
+            stove = await Stove.create(host, skip_ident=True, transport=transport)
+            try:
+                for attempt in range(1, retries + 2):
+                    report.attempts[host] = attempt
+                    try:
+                        await stove.write_packed_file(filename, blocks)
+                    except (
+                        c.FileOpenFailedError,
+                        c.FileWriteFailedError,
+                        aiohttp.ClientError,
+                        OSError,
+                    ) as exc:
+                        _LOGGER.warning(
+                            "Writing %s to %s failed (attempt %d): %r",
+                            filename,
+                            host,
+                            attempt,
+                            exc,
+                        )
+                        report.failed[host] = exc
+                        if attempt <= retries:
+                            await asyncio.sleep(retry_delay)
+                        continue
+                    report.failed.pop(host, None)
+                    report.succeeded.append(host)
+                    report.bytes_sent += len(data)
+                    return
+            finally:
+                await stove.destroy()
+
+    start = time.monotonic()
+    try:
+        await asyncio.gather(*[upload(host) for host in hosts])
+    finally:
+        report.elapsed = time.monotonic() - start
+        if own_transport:
+            await transport.close()
+    return report
@@ -0,0 +1,131 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+import ipaddress
+import json
+import logging
+import struct
+
+import aiohttp
+
+from .pystove import IDENT_IP, IDENT_MDNS, IDENT_NAME, STOVE_ID_URL, mac_from_mdns
+from .transport import HTTP_HEADERS
+
+_LOGGER = logging.getLogger(__name__)
+
+DISCOVERY_HOST = "host"
+DISCOVERY_MAC_ADDRESS = "mac_address"
+
+MDNS_ADDRESS = ("224.0.0.251", 5353)
+MDNS_SERVICE = "_http._tcp.local"
+MDNS_TYPE_PTR = 12
+MDNS_CLASS_IN_UNICAST = 0x8001
+
+
+async def discover(network, concurrency=256, timeout=1.0):
+    """Scan a network for stoves.
+
+    Network is a CIDR string (e.g. "192.168.1.0/24") or an iterable of
+    hosts. At most concurrency hosts are probed at the same time, each
+    with the given timeout in seconds. Returns a list of dicts with the
+    name, ip, mdns, mac_address and host of each stove found.
+    """
+    if isinstance(network, str):
+        hosts = (str(ip) for ip in ipaddress.ip_network(network).hosts())
+    else:
+        hosts = iter(network)
+    found = []
+
+    async def worker(session):
+        for host in hosts:
+            stove_id = await probe(session, host)
+            if stove_id is not None:
+                found.append(stove_id)
+
+    async with aiohttp.ClientSession(
+        headers=HTTP_HEADERS,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        connector=aiohttp.TCPConnector(limit=concurrency, force_close=True),
+    ) as session:
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+    return found
+
+
+async def discover_mdns(listen=2.0, service=MDNS_SERVICE, concurrency=32, timeout=1.0):
+    """Find stoves by listening for mDNS responses.
+
+    Sends a single query for service and probes every host that answers
+    within listen seconds. Returns the same result as discover().
+    """
+    loop = asyncio.get_running_loop()
+    responders = set()
+
+    class Protocol(asyncio.DatagramProtocol):
+        def datagram_received(self, data, addr):
+            responders.add(addr[0])
+
+    transport, _ = await loop.create_datagram_endpoint(
+        Protocol,
+        local_addr=("0.0.0.0", 0),  # nosec B104
+    )
+    try:
+        transport.sendto(_mdns_query(service), MDNS_ADDRESS)
+        await asyncio.sleep(listen)
+    finally:
+        transport.close()
+    return await discover(sorted(responders), concurrency, timeout)
+
+
+async def probe(session, host):
+    """Request identification from host, return None if it is no stove."""
+    try:
+        async with session.get("http://" + host + STOVE_ID_URL) as response:
+            if response.status != 200:
+                return
+            stove_id = json.loads(await response.text())
+    except (TimeoutError, aiohttp.ClientError, ValueError):
+        return
+    if not isinstance(stove_id, dict) or IDENT_MDNS not in stove_id:
+        return
+    try:
+        mac_address = mac_from_mdns(stove_id[IDENT_MDNS])
+    except ValueError:
+        _LOGGER.warning("Host %s reported invalid MDNS.", host)
+        return
+    return {
+        DISCOVERY_HOST: host,
+        IDENT_NAME: stove_id.get(IDENT_NAME),
+        IDENT_IP: stove_id.get(IDENT_IP, host),
+        IDENT_MDNS: stove_id[IDENT_MDNS],
+        DISCOVERY_MAC_ADDRESS: mac_address,
+    }
+
+
+def _mdns_query(service):
+    """Build an mDNS PTR query asking for unicast responses."""
+    header = struct.pack("!6H", 0, 0, 1, 0, 0, 0)
+    qname = b"".join(
+        bytes([len(label)]) + label.encode("ascii") for label in service.split(".")
+    )
+    return (
+        header
+        + qname
+        + b"\0"
+        + struct.pack("!2H", MDNS_TYPE_PTR, MDNS_CLASS_IN_UNICAST)
+    )
@@ -0,0 +1,218 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+from collections import deque
+import logging
+
+from . import const as c
+
+_LOGGER = logging.getLogger(__name__)
+
+EVENT_CHANGED = "changed"
+EVENT_CLEARED = "cleared"
+EVENT_RAISED = "raised"
+
+POLICY_COALESCE = "coalesce"
+POLICY_DROP_NEWEST = "drop_newest"
+POLICY_DROP_OLDEST = "drop_oldest"
+
+_FLAG_FIELDS = {
+    c.DATA_SAFETY_ALARMS: c.SafetyAlarm,
+    c.DATA_MAINTENANCE_ALARMS: c.MaintenanceAlarm,
+}
+
+
+class Event:
+    """A change of an alarm or mode of a stove."""
+
+    __slots__ = ("host", "kind", "field", "value", "previous", "timestamp")
+
+    def __init__(self, host, kind, field, value, previous=None, timestamp=None):
+        """Initialize the event."""
+        self.host = host
+        self.kind = kind
+        self.field = field
+        self.value = value
+        self.previous = previous
+        self.timestamp = timestamp
+
+    @property
+    def key(self):
+        """Return the key used to coalesce events."""
+        if self.field in _FLAG_FIELDS:
+            return (self.host, self.field, self.value)
+        return (self.host, self.field)
+
+    def __repr__(self):
+        return (
+            f"<Event {self.host} {self.field} {self.kind}: {self.value!r}"
+            f" (previous={self.previous!r})>"
+        )
+
+
+class AlarmMonitor:
+    """Detect alarm and operation mode changes between get_data results.
+
+    Emits raised and cleared events per SafetyAlarm and MaintenanceAlarm
+    flag and for the refill alarm, and changed events for the operation
+    mode. On the first update, raised events are emitted for all active
+    alarms. If a bus is given, events are also published to it.
+    """
+
+    def __init__(self, host=None, bus=None):
+        """Initialize the monitor."""
+        self.host = host
+        self.bus = bus
+        self._state = None
+
+    def update(self, data):
+        """Process a get_data result, return the list of new events."""
+        timestamp = data.get(c.DATA_DATE_TIME)
+        previous = self._state or {}
+        events = []
+
+        def emit(kind, field, value, prev=None):
+            events.append(Event(self.host, kind, field, value, prev, timestamp))
+
+        for field, flag_type in _FLAG_FIELDS.items():
+            new = flag_type(data[field])
+            old = flag_type(previous.get(field, 0))
+            for flag in flag_type:
+                if flag & (new ^ old):
+                    emit(EVENT_RAISED if flag & new else EVENT_CLEARED, field, flag)
+
+        refill_alarm = bool(data[c.DATA_REFILL_ALARM])
+        if refill_alarm != bool(previous.get(c.DATA_REFILL_ALARM)):
+            emit(
+                EVENT_RAISED if refill_alarm else EVENT_CLEARED,
+                c.DATA_REFILL_ALARM,
+                refill_alarm,
+            )
+
+        mode = c.OperationMode(data[c.DATA_OPERATION_MODE])
+        if self._state is not None and mode != previous[c.DATA_OPERATION_MODE]:
+            emit(
+                EVENT_CHANGED,
+                c.DATA_OPERATION_MODE,
+                mode,
+                previous[c.DATA_OPERATION_MODE],
+            )
+
+        self._state = {
+            c.DATA_SAFETY_ALARMS: data[c.DATA_SAFETY_ALARMS],
+            c.DATA_MAINTENANCE_ALARMS: data[c.DATA_MAINTENANCE_ALARMS],
+            c.DATA_REFILL_ALARM: refill_alarm,
+            c.DATA_OPERATION_MODE: mode,
+        }
+        if self.bus is not None and events:
+            self.bus.publish(events)
+        return events
+
+
+class Subscription:
+    """Bounded event queue of a single subscriber.
+
+    Iterate with async for. With coalesce, a new event always replaces a
+    queued event with the same key, so only the latest is delivered. When
+    the queue is full, drop_oldest and coalesce discard the oldest queued
+    event and drop_newest discards the new event.
+    """
+
+    def __init__(self, bus, maxsize, policy):
+        """Initialize the subscription."""
+        if policy not in (POLICY_COALESCE, POLICY_DROP_NEWEST, POLICY_DROP_OLDEST):
+            raise ValueError(f"Unknown policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self._bus = bus
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._closed = False
+
+    def put(self, event):
+        """Queue an event without blocking."""
+        if self._closed:
+            return
+        if self.policy == POLICY_COALESCE:
+            key = event.key
+            for i, queued in enumerate(self._queue):
+                if queued.key == key:
+                    del self._queue[i]
+                    self.dropped += 1
+                    break
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == POLICY_DROP_NEWEST:
+                return
+            self._queue.popleft()
+        self._queue.append(event)
+        self._wakeup.set()
+
+    async def get(self):
+        """Wait for and return the next event, None when closed."""
+        while not self._queue:
+            if self._closed:
+                return None
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        return self._queue.popleft()
+
+    def close(self):
+        """Unsubscribe from the bus."""
+        self._closed = True
+        self._bus.unsubscribe(self)
+        self._wakeup.set()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+
+class EventBus:
+    """Fan out events to any number of subscribers without blocking."""
+
+    def __init__(self):
+        """Initialize the bus."""
+        self._subscribers = []
+
+    def subscribe(self, maxsize=100, policy=POLICY_DROP_OLDEST):
+        """Return a new Subscription."""
+        subscription = Subscription(self, maxsize, policy)
+        self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription."""
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+
+    def publish(self, events):
+        """Queue events for all subscribers."""
+        for subscription in self._subscribers:
+            for event in events:
+                subscription.put(event)
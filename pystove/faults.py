@@ -0,0 +1,201 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+from collections import Counter
+import logging
+import random
+import time
+
+import aiohttp
+
+_LOGGER = logging.getLogger(__name__)
+
+FAULT_EMPTY = "empty"
+FAULT_GARBAGE = "garbage"
+FAULT_RESET = "reset"
+FAULT_TRUNCATE = "truncate"
+FAULT_TYPO = "typo"
+FAULT_WRITE_DROP = "write_drop"
+
+# Faults that apply to HTTP responses, in the order they are drawn.
+HTTP_FAULTS = (FAULT_RESET, FAULT_EMPTY, FAULT_TRUNCATE, FAULT_GARBAGE, FAULT_TYPO)
+# Faults that apply to raw writes, in the order they are drawn.
+WRITE_FAULTS = (FAULT_RESET, FAULT_WRITE_DROP)
+
+GARBAGE = '{"response": "OK", <html>Internal error</html>'
+
+
+class LatencyStats:
+    """Latency samples of transport calls.
+
+    Count, mean and max cover all calls, percentiles are estimated from a
+    uniform random sample of at most size calls, so memory use is bounded.
+    """
+
+    def __init__(self, size=1024, seed=None):
+        """Initialize without samples."""
+        self.size = size
+        self.samples = []
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+        self._random = random.Random(seed)  # nosec B311
+
+    def add(self, seconds):
+        """Add a sample."""
+        self.count += 1
+        self.total += seconds
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        if len(self.samples) < self.size:
+            self.samples.append(seconds)
+            return
+        # Reservoir sampling, keep every call with equal probability.
+        index = self._random.randrange(self.count)
+        if index < self.size:
+            self.samples[index] = seconds
+
+    def percentile(self, percent):
+        """Return the latency below which percent of the samples fall."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+    def summary(self):
+        """Return a dict with count, mean, p50, p90, p99 and max."""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class FaultInjectingTransport:
+    """Transport wrapper that injects the faults seen on real stoves.
+
+    Every call is delayed by latency plus a random jitter. Rates are the
+    probabilities of a fault per call:
+
+    - reset: the connection fails before the request is sent
+    - empty: the response body is empty
+    - truncate: the response body is cut off halfway
+    - garbage: the response body is not valid JSON
+    - typo: "response" keys are misspelled "reponse", like the self test
+    - write_drop: a raw write reaches the stove, but the connection drops
+      before the response is received
+
+    Latency of every call is recorded in stats, injected faults are
+    counted in faults.
+    """
+
+    def __init__(
+        self,
+        inner,
+        latency=0.0,
+        jitter=0.0,
+        reset_rate=0.0,
+        empty_rate=0.0,
+        truncate_rate=0.0,
+        garbage_rate=0.0,
+        typo_rate=0.0,
+        write_drop_rate=0.0,
+        seed=None,
+    ):
+        """Initialize the transport around inner."""
+        self.inner = inner
+        self.latency = latency
+        self.jitter = jitter
+        self.rates = {
+            FAULT_EMPTY: empty_rate,
+            FAULT_GARBAGE: garbage_rate,
+            FAULT_RESET: reset_rate,
+            FAULT_TRUNCATE: truncate_rate,
+            FAULT_TYPO: typo_rate,
+            FAULT_WRITE_DROP: write_drop_rate,
+        }
+        self.stats = LatencyStats(seed=seed)
+        self.faults = Counter()
+        self._random = random.Random(seed)  # nosec B311
+
+    def _pick(self, faults):
+        """Draw the fault for a call, None for no fault."""
+        draw = self._random.random()
+        for fault in faults:
+            draw -= self.rates[fault]
+            if draw < 0:
+                self.faults[fault] += 1
+                return fault
+        return None
+
+    async def _delay(self):
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _corrupt(self, text, fault):
+        if fault == FAULT_EMPTY:
+            return ""
+        if fault == FAULT_TRUNCATE:
+            return text[: len(text) // 2]
+        if fault == FAULT_GARBAGE:
+            return GARBAGE
+        if fault == FAULT_TYPO:
+            return text.replace('"response"', '"reponse"')
+        return text
+
+    async def _http(self, call):
+        start = time.monotonic()
+        try:
+            await self._delay()
+            fault = self._pick(HTTP_FAULTS)
+            if fault == FAULT_RESET:
+                raise aiohttp.ServerDisconnectedError()
+            return self._corrupt(await call(), fault)
+        finally:
+            self.stats.add(time.monotonic() - start)
+
+    async def get(self, url):
+        """Get data from url, possibly failing."""
+        return await self._http(lambda: self.inner.get(url))
+
+    async def post(self, url, body):
+        """Post body to url, possibly failing."""
+        return await self._http(lambda: self.inner.post(url, body))
+
+    async def write(self, host, request):
+        """Send a raw request to host, possibly failing."""
+        start = time.monotonic()
+        try:
+            await self._delay()
+            fault = self._pick(WRITE_FAULTS)
+            if fault == FAULT_RESET:
+                raise ConnectionResetError("Injected connection reset")
+            response = await self.inner.write(host, request)
+            return b"" if fault == FAULT_WRITE_DROP else response
+        finally:
+            self.stats.add(time.monotonic() - start)
+
+    async def close(self):
+        """Close the inner transport."""
+        await self.inner.close()
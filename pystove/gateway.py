@@ -0,0 +1,265 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from aiohttp import web
+
+from .pystove import (
+    RESPONSE_SUCCESS,
+    STOVE_ACCESSPOINT_URL,
+    STOVE_BURN_LEVEL_URL,
+    STOVE_CLOSE_FILE_URL,
+    STOVE_DATA_URL,
+    STOVE_DELETE_FILE_URL,
+    STOVE_ID_URL,
+    STOVE_LIVE_DATA_URL,
+    STOVE_NIGHT_LOWERING_OFF_URL,
+    STOVE_NIGHT_LOWERING_ON_URL,
+    STOVE_NIGHT_TIME_URL,
+    STOVE_OPEN_FILE_URL,
+    STOVE_READ_OPEN_FILE_URL,
+    STOVE_REMOTE_REFILL_ALARM_URL,
+    STOVE_SELFTEST_RESULT_URL,
+    STOVE_SELFTEST_START_URL,
+    STOVE_SET_TIME_URL,
+    STOVE_START_URL,
+    Stove,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+CACHED_URLS = (
+    STOVE_ACCESSPOINT_URL,
+    STOVE_DATA_URL,
+    STOVE_ID_URL,
+    STOVE_LIVE_DATA_URL,
+)
+FORWARDED_GET_URLS = (
+    STOVE_CLOSE_FILE_URL,
+    STOVE_NIGHT_LOWERING_OFF_URL,
+    STOVE_NIGHT_LOWERING_ON_URL,
+    STOVE_SELFTEST_RESULT_URL,
+    STOVE_SELFTEST_START_URL,
+    STOVE_START_URL,
+)
+FORWARDED_POST_URLS = (
+    STOVE_BURN_LEVEL_URL,
+    STOVE_DELETE_FILE_URL,
+    STOVE_NIGHT_TIME_URL,
+    STOVE_OPEN_FILE_URL,
+    STOVE_READ_OPEN_FILE_URL,
+    STOVE_REMOTE_REFILL_ALARM_URL,
+    STOVE_SET_TIME_URL,
+)
+# The stove has a single open file, these are locked to one client.
+FILE_URLS = (
+    STOVE_CLOSE_FILE_URL,
+    STOVE_DELETE_FILE_URL,
+    STOVE_OPEN_FILE_URL,
+    STOVE_READ_OPEN_FILE_URL,
+)
+
+
+class Gateway:
+    """HTTP server that multiplexes many clients onto one stove.
+
+    The gateway serves the stove's own endpoints. Reads are served from a
+    cache that is refreshed at most once per cache_ttl seconds, with
+    concurrent requests sharing a single refresh. All requests to the
+    stove are sent one at a time, and any write invalidates the cache.
+    Raw file writes (/write_open_file) are not supported.
+
+    A client (by remote address) that opens a file holds the stove's
+    single open file until it closes it, or until file_timeout seconds
+    pass without file requests. Meanwhile file requests of other clients
+    get 409 Conflict.
+    """
+
+    def __init__(self, stove, cache_ttl=2.0, file_timeout=30.0):
+        """Initialize the gateway for a Stove object."""
+        self.stove = stove
+        self.cache_ttl = cache_ttl
+        self.file_timeout = file_timeout
+        self.app = web.Application()
+        self._base_url = "http://" + stove.stove_host
+        self._cache = {}
+        self._file_owner = None
+        self._file_expires = 0
+        self._lock = asyncio.Lock()
+        self._runner = None
+        for url in CACHED_URLS:
+            self.app.router.add_get(url, self._handle_cached)
+        for url in FORWARDED_GET_URLS:
+            self.app.router.add_get(url, self._handle_get)
+        for url in FORWARDED_POST_URLS:
+            self.app.router.add_post(url, self._handle_post)
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """Start serving on host and port."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        """Stop serving."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def invalidate(self):
+        """Drop all cached responses."""
+        self._cache.clear()
+
+    async def _handle_cached(self, request):
+        path = request.path
+        expires, future = self._cache.get(path, (0, None))
+        if future is None or (future.done() and time.monotonic() >= expires):
+            future = asyncio.ensure_future(self._forward_get(path))
+            self._cache[path] = (float("inf"), future)
+            future.add_done_callback(lambda f: self._cache_done(path, f))
+        return self._response(await asyncio.shield(future))
+
+    def _cache_done(self, path, future):
+        entry = self._cache.get(path)
+        if entry is None or entry[1] is not future:
+            return
+        if future.cancelled() or future.exception() or future.result() is None:
+            # Do not cache failures
+            del self._cache[path]
+        else:
+            self._cache[path] = (time.monotonic() + self.cache_ttl, future)
+
+    async def _handle_get(self, request):
+        self.invalidate()
+        if request.path in FILE_URLS:
+            self._claim_file(request)
+        text = await self._forward_get(request.path)
+        if request.path == STOVE_CLOSE_FILE_URL and text is not None:
+            self._file_owner = None
+        return self._response(text)
+
+    async def _handle_post(self, request):
+        try:
+            data = json.loads(await request.text() or "{}")
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="Invalid JSON") from None
+        self.invalidate()
+        if request.path in FILE_URLS:
+            self._claim_file(request)
+        async with self._lock:
+            text = await self.stove._post(self._base_url + request.path, data)
+        if request.path == STOVE_OPEN_FILE_URL and not self._file_opened(text):
+            self._file_owner = None
+        return self._response(text)
+
+    def _claim_file(self, request):
+        """Make the client the file owner, raise 409 if another client is.
+
+        Deleting a file only requires that no other client has one open.
+        """
+        now = time.monotonic()
+        if self._file_owner not in (None, request.remote) and now < self._file_expires:
+            raise web.HTTPConflict(text="Another client has a file open")
+        if request.path == STOVE_DELETE_FILE_URL:
+            return
+        self._file_owner = request.remote
+        self._file_expires = now + self.file_timeout
+
+    @staticmethod
+    def _file_opened(text):
+        try:
+            return bool(text) and json.loads(text).get(RESPONSE_SUCCESS) == 1
+        except (json.JSONDecodeError, AttributeError):
+            return False
+
+    async def _forward_get(self, path):
+        async with self._lock:
+            return await self.stove._get(self._base_url + path)
+
+    @staticmethod
+    def _response(text):
+        if text is None:
+            raise web.HTTPBadGateway(text="No response from stove")
+        return web.Response(text=text, content_type="application/json")
+
+
+async def run_gateway(stove_host, listen="127.0.0.1", port=8080, cache_ttl=2.0):
+    """Run a gateway for stove_host until cancelled."""
+    stove = await Stove.create(stove_host, skip_ident=True)
+    gateway = Gateway(stove, cache_ttl)
+    try:
+        await gateway.start(listen, port)
+        _LOGGER.info("Serving %s on %s:%d", stove_host, listen, port)
+        await asyncio.Event().wait()
+    finally:
+        await gateway.stop()
+        await stove.destroy()
+
+
+if __name__ == "__main__":
+    """Handle direct invocation from command line."""
+    import getopt
+
+    def print_help():
+        """Print help message."""
+        print("Usage: python -m pystove.gateway <options>")
+        print()
+        print("Options:")
+        print()
+        print("  -h, --host <HOST>\t\tRequired")
+        print("    The IP address or hostname of the stove.")
+        print()
+        print("  -l, --listen <ADDRESS>\tOptional")
+        print("    The address to listen on. Defaults to 127.0.0.1.")
+        print()
+        print("  -p, --port <PORT>\t\tOptional")
+        print("    The port to listen on. Defaults to 8080.")
+        print()
+        print("  -t, --ttl <SECONDS>\t\tOptional")
+        print("    How long read responses are cached. Defaults to 2.")
+        print()
+        sys.exit()
+
+    stove_host = None
+    listen = "127.0.0.1"
+    port = 8080
+    cache_ttl = 2.0
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], "h:l:p:t:", ["host=", "listen=", "port=", "ttl="]
+        )
+    except getopt.GetoptError:
+        print_help()
+    for opt, arg in opts:
+        if opt in ("-h", "--host"):
+            stove_host = arg
+        elif opt in ("-l", "--listen"):
+            listen = arg
+        elif opt in ("-p", "--port"):
+            port = int(arg)
+        elif opt in ("-t", "--ttl"):
+            cache_ttl = float(arg)
+    if stove_host is None:
+        print_help()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_gateway(stove_host, listen, port, cache_ttl))
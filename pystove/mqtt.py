@@ -0,0 +1,331 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+import contextlib
+from datetime import date, time, timedelta
+from enum import Enum, IntFlag
+import logging
+import os
+
+from . import const as c
+from .transport import split_host
+
+_LOGGER = logging.getLogger(__name__)
+
+# MQTT 3.1.1 control packet types (upper nibble of the first byte).
+PACKET_CONNECT = 0x10
+PACKET_CONNACK = 0x20
+PACKET_PUBLISH = 0x30
+PACKET_PINGREQ = 0xC0
+PACKET_PINGRESP = 0xD0
+PACKET_DISCONNECT = 0xE0
+
+PUBLISH_RETAIN = 0x01
+
+CONNECT_CLEAN_SESSION = 0x02
+CONNECT_PASSWORD = 0x40
+CONNECT_USERNAME = 0x80
+
+PROTOCOL_NAME = "MQTT"
+PROTOCOL_LEVEL = 4
+
+DEFAULT_PORT = 1883
+
+# Slow-moving configuration, published as retained messages.
+RETAINED_FIELDS = frozenset(
+    (
+        c.DATA_ALGORITHM,
+        c.DATA_BURN_LEVEL,
+        c.DATA_FIRMWARE_VERSION,
+        c.DATA_NIGHT_BEGIN_TIME,
+        c.DATA_NIGHT_END_TIME,
+        c.DATA_REMOTE_REFILL_ALARM,
+        c.DATA_REMOTE_VERSION,
+    )
+)
+
+
+def encode_length(length):
+    """Encode an MQTT remaining length."""
+    out = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        out.append(digit | 0x80 if length else digit)
+        if not length:
+            return bytes(out)
+
+
+def encode_string(value):
+    """Encode an MQTT length prefixed string."""
+    data = value.encode("utf-8") if isinstance(value, str) else value
+    return len(data).to_bytes(2, "big") + data
+
+
+def connect_packet(client_id, keepalive=60, username=None, password=None):
+    """Return a CONNECT packet."""
+    flags = CONNECT_CLEAN_SESSION
+    payload = encode_string(client_id)
+    if username is not None:
+        flags |= CONNECT_USERNAME
+        payload += encode_string(username)
+        if password is not None:
+            flags |= CONNECT_PASSWORD
+            payload += encode_string(password)
+    body = (
+        encode_string(PROTOCOL_NAME)
+        + bytes((PROTOCOL_LEVEL, flags))
+        + keepalive.to_bytes(2, "big")
+        + payload
+    )
+    return bytes((PACKET_CONNECT,)) + encode_length(len(body)) + body
+
+
+def publish_packet(topic, payload, retain=False):
+    """Return a QoS 0 PUBLISH packet."""
+    body = encode_string(topic) + payload
+    header = PACKET_PUBLISH | (PUBLISH_RETAIN if retain else 0)
+    return bytes((header,)) + encode_length(len(body)) + body
+
+
+async def read_packet(reader):
+    """Read a packet from reader, return a (first byte, body) tuple."""
+    header = (await reader.readexactly(1))[0]
+    length = 0
+    for shift in range(0, 28, 7):
+        digit = (await reader.readexactly(1))[0]
+        length |= (digit & 0x7F) << shift
+        if not digit & 0x80:
+            break
+    return header, await reader.readexactly(length)
+
+
+def format_value(value):
+    """Format a processed stove data value as an MQTT payload string.
+
+    Alarm flags are published as integers, other enums by name, dates
+    and times in ISO format and durations in seconds.
+    """
+    if isinstance(value, IntFlag):
+        return str(int(value))
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return str(int(value.total_seconds()))
+    return str(value)
+
+
+class MqttConnection:
+    """A single QoS 0 publishing connection to an MQTT broker."""
+
+    def __init__(
+        self,
+        broker,
+        client_id=None,
+        keepalive=60,
+        username=None,
+        password=None,
+    ):
+        """Initialize the connection, broker is a host[:port] string."""
+        self.host, self.port = split_host(broker, DEFAULT_PORT)
+        self.client_id = client_id or f"pystove-{os.getpid()}"
+        self.keepalive = keepalive
+        self.username = username
+        self.password = password
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._ping_task = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self):
+        """Return whether the connection is up."""
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        """Connect to the broker, raise ConnectionError if refused."""
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._writer.write(
+            connect_packet(self.client_id, self.keepalive, self.username, self.password)
+        )
+        await self._writer.drain()
+        header, body = await read_packet(self._reader)
+        if header != PACKET_CONNACK or len(body) < 2 or body[1] != 0:
+            await self._disconnect()
+            raise ConnectionError(f"MQTT broker refused connection: {body!r}")
+        self._reader_task = asyncio.create_task(self._read_loop())
+        self._ping_task = asyncio.create_task(self._ping_loop())
+
+    async def publish_many(self, messages):
+        """Publish (topic, payload, retain) tuples in a single write.
+
+        Payloads are str or bytes. Reconnects first if the connection
+        was lost.
+        """
+        packet = b"".join(
+            publish_packet(
+                topic,
+                payload.encode("utf-8") if isinstance(payload, str) else payload,
+                retain,
+            )
+            for topic, payload, retain in messages
+        )
+        if not packet:
+            return
+        async with self._lock:
+            if not self.connected:
+                await self._disconnect()
+                await self.connect()
+            self._writer.write(packet)
+            await self._writer.drain()
+
+    async def close(self):
+        """Disconnect from the broker."""
+        if self.connected:
+            with contextlib.suppress(ConnectionError):
+                self._writer.write(bytes((PACKET_DISCONNECT, 0)))
+                await self._writer.drain()
+        await self._disconnect()
+
+    async def _disconnect(self):
+        for task in (self._reader_task, self._ping_task):
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+        self._reader_task = self._ping_task = None
+        if self._writer is not None:
+            self._writer.close()
+            with contextlib.suppress(OSError):
+                await self._writer.wait_closed()
+            self._writer = None
+
+    async def _read_loop(self):
+        """Consume PINGRESP packets, notice when the broker goes away."""
+        try:
+            while True:
+                await read_packet(self._reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            _LOGGER.warning("Lost connection to MQTT broker.")
+            self._writer.close()
+
+    async def _ping_loop(self):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            async with self._lock:
+                if not self.connected:
+                    return
+                try:
+                    self._writer.write(bytes((PACKET_PINGREQ, 0)))
+                    await self._writer.drain()
+                except OSError:
+                    # Reconnecting is left to the next publish.
+                    _LOGGER.warning("Lost connection to MQTT broker.")
+                    self._writer.close()
+                    return
+
+
+class StovePublisher:
+    """Publish processed stove data to MQTT, only sending changed values.
+
+    Every field is published to <prefix>/<stove_id>/<field>. Updates are
+    collected and sent in one batch per flush interval, a field that
+    changes several times within an interval is only published once.
+    Fields in retained are published as retained messages.
+    """
+
+    def __init__(
+        self,
+        connection,
+        prefix="pystove",
+        interval=1.0,
+        retained=RETAINED_FIELDS,
+        exclude=(c.DATA_DATE_TIME,),
+    ):
+        """Initialize the publisher on a shared MqttConnection."""
+        self.connection = connection
+        self.prefix = prefix
+        self.interval = interval
+        self.retained = retained
+        self.exclude = frozenset(exclude)
+        self.published = 0
+        self.suppressed = 0
+        self.batches = 0
+        self._last = {}
+        self._pending = {}
+        self._task = None
+
+    def update(self, stove_id, data):
+        """Queue the changed fields of a get_data result for publishing."""
+        for field, value in data.items():
+            if field in self.exclude:
+                continue
+            topic = f"{self.prefix}/{stove_id}/{field}"
+            payload = format_value(value)
+            if self._last.get(topic) == payload:
+                self._pending.pop(topic, None)
+                self.suppressed += 1
+                continue
+            self._pending[topic] = (payload, field in self.retained)
+
+    async def poll(self, stove, stove_id=None):
+        """Get data from stove and queue it, stove_id defaults to its host."""
+        data = await stove.get_data()
+        if data:
+            self.update(stove_id or stove.stove_host, data)
+        return data
+
+    async def flush(self):
+        """Publish all queued values in one batch."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        messages = [
+            (topic, payload, retain) for topic, (payload, retain) in pending.items()
+        ]
+        try:
+            await self.connection.publish_many(messages)
+        except (OSError, asyncio.IncompleteReadError):
+            _LOGGER.exception("Publishing to MQTT broker failed.")
+            # Retry with the next flush, unless newer values were queued.
+            for topic, value in pending.items():
+                self._pending.setdefault(topic, value)
+            return
+        for topic, (payload, _) in pending.items():
+            self._last[topic] = payload
+        self.published += len(messages)
+        self.batches += 1
+
+    async def start(self):
+        """Start flushing every interval."""
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flush task and publish what is queued."""
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
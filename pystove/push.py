@@ -0,0 +1,279 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+import contextlib
+import json
+import logging
+import sys
+
+from aiohttp import WSMsgType, web
+
+from .events import POLICY_COALESCE, Subscription
+from .mqtt import format_value
+from .pystove import Stove
+
+_LOGGER = logging.getLogger(__name__)
+
+KIND_DATA = "data"
+KIND_LIVE = "live"
+
+EVENTS_URL = "/events"
+WEBSOCKET_URL = "/ws"
+
+SSE_HEADERS = {
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+SSE_PING = b": ping\n\n"
+
+
+class Update:
+    """A stove state update, encoded once for all clients."""
+
+    __slots__ = ("key", "text", "sse")
+
+    def __init__(self, stove_id, kind, data):
+        """Encode data of kind for stove_id."""
+        self.key = (stove_id, kind)
+        self.text = json.dumps(
+            {"stove": stove_id, "kind": kind, "data": data},
+            default=format_value,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        self.sse = b"event: " + kind.encode() + b"\ndata: " + self.text + b"\n\n"
+
+
+class PushServer:
+    """HTTP server that pushes stove state to browsers.
+
+    Stoves are polled once for all clients, every interval seconds for
+    get_data and every live_interval seconds for get_live_data (not
+    polled if None). Changed state is encoded once and sent to every
+    client over Server-Sent Events (/events) or WebSockets (/ws), both
+    optionally limited to one stove with ?stove=<host>. Every client has
+    a buffer of at most buffer updates, a newer update of the same stove
+    and kind replaces a queued one, so slow clients skip stale state.
+    """
+
+    def __init__(self, stoves, interval=2.0, live_interval=None, buffer=16, ping=15):
+        """Initialize the server for a list of Stove objects."""
+        self.stoves = stoves
+        self.interval = interval
+        self.live_interval = live_interval
+        self.buffer = buffer
+        self.ping = ping
+        self.published = 0
+        self.app = web.Application()
+        self.app.router.add_get(EVENTS_URL, self._handle_events)
+        self.app.router.add_get(WEBSOCKET_URL, self._handle_websocket)
+        self._latest = {}
+        self._subscribers = {}
+        self._tasks = []
+        self._runner = None
+
+    @property
+    def clients(self):
+        """Return the number of connected clients."""
+        return len(self._subscribers)
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """Start polling and serving on host and port."""
+        for stove in self.stoves:
+            self._tasks.append(asyncio.create_task(self._poll(stove, KIND_DATA)))
+            if self.live_interval is not None:
+                self._tasks.append(asyncio.create_task(self._poll(stove, KIND_LIVE)))
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        """Stop polling, disconnect clients and stop serving."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for subscription in list(self._subscribers):
+            subscription.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def publish(self, stove_id, kind, data):
+        """Send data to all clients, return False if it did not change."""
+        update = Update(stove_id, kind, data)
+        previous = self._latest.get(update.key)
+        if previous is not None and previous.text == update.text:
+            return False
+        self._latest[update.key] = update
+        for subscription, stove_filter in self._subscribers.items():
+            if stove_filter is None or stove_filter == stove_id:
+                subscription.put(update)
+        self.published += 1
+        return True
+
+    def subscribe(self, stove_filter=None):
+        """Return a Subscription that starts with the latest state."""
+        subscription = Subscription(self, self.buffer, POLICY_COALESCE)
+        self._subscribers[subscription] = stove_filter
+        for key, update in self._latest.items():
+            if stove_filter is None or stove_filter == key[0]:
+                subscription.put(update)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription."""
+        self._subscribers.pop(subscription, None)
+
+    async def _poll(self, stove, kind):
+        interval = self.interval if kind == KIND_DATA else self.live_interval
+        while True:
+            try:
+                # Cancel requests that would overrun into the next poll.
+                if kind == KIND_DATA:
+                    data = await stove.get_data(timeout=interval)
+                else:
+                    data = await stove.get_live_data(timeout=interval)
+            except Exception:  # noqa: BLE001
+                _LOGGER.exception("%s: polling failed.", stove.stove_host)
+            else:
+                if data:
+                    self.publish(stove.stove_host, kind, data)
+            await asyncio.sleep(interval)
+
+    async def _handle_events(self, request):
+        response = web.StreamResponse(headers=SSE_HEADERS)
+        await response.prepare(request)
+        subscription = self.subscribe(request.query.get("stove"))
+        try:
+            while True:
+                try:
+                    update = await asyncio.wait_for(subscription.get(), self.ping)
+                except TimeoutError:
+                    await response.write(SSE_PING)
+                    continue
+                if update is None:
+                    break
+                await response.write(update.sse)
+        except ConnectionError:
+            pass
+        finally:
+            subscription.close()
+        return response
+
+    async def _handle_websocket(self, request):
+        response = web.WebSocketResponse(heartbeat=self.ping, compress=False)
+        await response.prepare(request)
+        subscription = self.subscribe(request.query.get("stove"))
+        reader = asyncio.create_task(self._read_websocket(response, subscription))
+        try:
+            while True:
+                update = await subscription.get()
+                if update is None:
+                    break
+                await response.send_frame(update.text, WSMsgType.TEXT)
+        except ConnectionError:
+            pass
+        finally:
+            subscription.close()
+            reader.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await reader
+            await response.close()
+        return response
+
+    @staticmethod
+    async def _read_websocket(response, subscription):
+        """Discard client messages, close the subscription on disconnect."""
+        async for _ in response:
+            pass
+        subscription.close()
+
+
+async def run_push_server(
+    stove_hosts, listen="127.0.0.1", port=8080, interval=2.0, live_interval=None
+):
+    """Run a push server for stove_hosts until cancelled."""
+    stoves = [await Stove.create(host, skip_ident=True) for host in stove_hosts]
+    server = PushServer(stoves, interval, live_interval)
+    try:
+        await server.start(listen, port)
+        _LOGGER.info("Serving %d stoves on %s:%d", len(stoves), listen, port)
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        for stove in stoves:
+            await stove.destroy()
+
+
+if __name__ == "__main__":
+    """Handle direct invocation from command line."""
+    import getopt
+
+    def print_help():
+        """Print help message."""
+        print("Usage: python -m pystove.push <options>")
+        print()
+        print("Options:")
+        print()
+        print("  -h, --host <HOST>\t\tRequired, may be repeated")
+        print("    The IP address or hostname of a stove.")
+        print()
+        print("  -l, --listen <ADDRESS>\tOptional")
+        print("    The address to listen on. Defaults to 127.0.0.1.")
+        print()
+        print("  -p, --port <PORT>\t\tOptional")
+        print("    The port to listen on. Defaults to 8080.")
+        print()
+        print("  -i, --interval <SECONDS>\tOptional")
+        print("    How often stove data is polled. Defaults to 2.")
+        print()
+        print("  -L, --live-interval <SECONDS>\tOptional")
+        print("    How often live data is polled. Not polled by default.")
+        print()
+        sys.exit()
+
+    stove_hosts = []
+    listen = "127.0.0.1"
+    port = 8080
+    interval = 2.0
+    live_interval = None
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            "h:l:p:i:L:",
+            ["host=", "listen=", "port=", "interval=", "live-interval="],
+        )
+    except getopt.GetoptError:
+        print_help()
+    for opt, arg in opts:
+        if opt in ("-h", "--host"):
+            stove_hosts.append(arg)
+        elif opt in ("-l", "--listen"):
+            listen = arg
+        elif opt in ("-p", "--port"):
+            port = int(arg)
+        elif opt in ("-i", "--interval"):
+            interval = float(arg)
+        elif opt in ("-L", "--live-interval"):
+            live_interval = float(arg)
+    if not stove_hosts:
+        print_help()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_push_server(stove_hosts, listen, port, interval, live_interval))
@@ -17,20 +17,30 @@
 #
 
 import asyncio
+import contextlib
+import contextvars
 from datetime import datetime, time, timedelta
 from enum import IntEnum
 import json
 import logging
+from operator import itemgetter
 import struct
+from urllib.parse import urlsplit
 
 import aiohttp
-from aiohttp.client_exceptions import ClientConnectorError
 import defusedxml.ElementTree as ET
 
 from . import const as c
+from .record import RecordingTransport
+from .transport import HttpTransport
 
 _LOGGER = logging.getLogger(__name__)
 
+# Seconds allowed for cleanup requests such as /close_file, which run
+# even when the deadline of the caller has passed.
+CLEANUP_TIMEOUT = 10
+
+FILE_BLOCK_SIZE = 1024
 FILE_MODE = "mode"
 FILE_NAME = "file_name"
 FILE_SIZE = "file_size"
@@ -49,8 +59,6 @@ KEY_ENABLE = "enable"
 KEY_LEVEL = "level"
 KEY_RESPONSE = "response"
 
-HTTP_HEADERS = {"Accept": "application/json"}
-
 RESPONSE_OK = "OK"
 RESPONSE_SUCCESS = "success"
 
@@ -73,6 +81,22 @@ STOVE_SELFTEST_START_URL = "/start_selftest"
 STOVE_START_URL = "/start"
 STOVE_WRITE_OPEN_FILE_URL = "/write_open_file"
 
+# Requests that change state on the stove, used for rate limiting.
+WRITE_URLS = frozenset(
+    (
+        STOVE_BURN_LEVEL_URL,
+        STOVE_DELETE_FILE_URL,
+        STOVE_NIGHT_LOWERING_OFF_URL,
+        STOVE_NIGHT_LOWERING_ON_URL,
+        STOVE_NIGHT_TIME_URL,
+        STOVE_REMOTE_REFILL_ALARM_URL,
+        STOVE_SELFTEST_START_URL,
+        STOVE_SET_TIME_URL,
+        STOVE_START_URL,
+        STOVE_WRITE_OPEN_FILE_URL,
+    )
+)
+
 YEAR = "year"
 MONTH = "month"
 DAY = "day"
@@ -80,6 +104,192 @@ HOURS = "hours"
 MINUTES = "minutes"
 SECONDS = "seconds"
 
+# Loop time by which stove requests of the current task must be done.
+_deadline = contextvars.ContextVar("pystove_deadline", default=None)
+# Keep references to running cleanup tasks.
+_cleanup_tasks = set()
+
+
+@contextlib.contextmanager
+def deadline(timeout):
+    """Limit stove requests within the block to timeout seconds from now.
+
+    The deadline applies to all requests made within the block, including
+    those of tasks started from it. Requests that would end after the
+    deadline are cancelled, and no new requests are sent once it passed.
+    Nested deadlines can only shorten the deadline. A timeout of None
+    leaves the deadline unchanged.
+    """
+    if timeout is None:
+        yield _deadline.get()
+        return
+    when = asyncio.get_running_loop().time() + timeout
+    current = _deadline.get()
+    if current is not None:
+        when = min(when, current)
+    token = _deadline.set(when)
+    try:
+        yield when
+    finally:
+        _deadline.reset(token)
+
+
+def _expired():
+    """Return whether the deadline of the current task has passed."""
+    when = _deadline.get()
+    return when is not None and asyncio.get_running_loop().time() >= when
+
+
+def mac_from_mdns(mdns):
+    """Derive the stove MAC address from its MDNS name, return as int."""
+    return int(mdns[-12:], 16) & 0xFDFFFFFFFFFF
+
+
+def pack_block(data, offset=0):
+    """Pack up to 1024 bytes of data into a raw write_open_file request."""
+    # write_open_file expects binary data:
+    # uint16 Size of binary data;
+    # uint32 Offset to write to;
+    # uint8[1024] data
+    data_length = len(data)
+    if data_length > FILE_BLOCK_SIZE:
+        raise RuntimeError(f"Data too long (>{FILE_BLOCK_SIZE} bytes)")
+    size = 2 + 4 + data_length
+    byte_array = struct.pack(f"<HI{data_length}s", size, offset, data)
+
+    request_string = (
+        f"POST {STOVE_WRITE_OPEN_FILE_URL} HTTP/1.1 \r\n"
+        f"content-length: {data_length} \r\n"
+        "Content-Type: binary \r\n"
+        "\r\n"
+    )
+    return request_string.encode("utf-8") + byte_array
+
+
+def pack_blocks(data):
+    """Pack data into a list of raw write_open_file requests."""
+    return [
+        pack_block(data[offset : offset + FILE_BLOCK_SIZE], offset)
+        for offset in range(0, len(data), FILE_BLOCK_SIZE)
+    ]
+
+
+def raw_datetime(data):
+    """Return the stove time in raw stove data as a datetime."""
+    return datetime(
+        data[YEAR],
+        data[MONTH],
+        data[DAY],
+        data[HOURS],
+        data[MINUTES],
+        data[SECONDS],
+    )
+
+
+def _burn_phase(phase):
+    return c.BurnPhase(phase if phase not in (2, 3) else 1)
+
+
+def _centi(value):
+    return float(value / 100)
+
+
+def _night_time(hour, minute):
+    # Stove uses 24:00 for end of day
+    return time(hour % 24, minute)
+
+
+def _refuel_estimate(year, month, day, hour, minute, second, hours, minutes):
+    return datetime(year, month, day, hour, minute, second) + timedelta(
+        hours=hours, minutes=minutes
+    )
+
+
+def _time_to_refuel(hours, minutes):
+    return timedelta(hours=hours, minutes=minutes)
+
+
+def _version(major, minor, build):
+    return f"{major}.{minor}.{build}"
+
+
+_DATETIME_KEYS = (YEAR, MONTH, DAY, HOURS, MINUTES, SECONDS)
+_REFUEL_KEYS = (c.DATA_NEW_FIREWOOD_HOURS, c.DATA_NEW_FIREWOOD_MINUTES)
+
+# Processed key -> (converter, raw keys passed to it). A converter of None
+# copies the single raw value unchanged. Shared by process_raw_data and
+# the columnar pystove.batch.process_batch.
+FIELD_CONVERTERS = {
+    c.DATA_ALGORITHM: (None, (c.DATA_ALGORITHM,)),
+    c.DATA_BURN_LEVEL: (None, (c.DATA_BURN_LEVEL,)),
+    c.DATA_MAINTENANCE_ALARMS: (c.MaintenanceAlarm, (c.DATA_MAINTENANCE_ALARMS,)),
+    c.DATA_MESSAGE_ID: (None, (c.DATA_MESSAGE_ID,)),
+    c.DATA_NEW_FIREWOOD_ESTIMATE: (_refuel_estimate, _DATETIME_KEYS + _REFUEL_KEYS),
+    c.DATA_NIGHT_BEGIN_TIME: (
+        _night_time,
+        (c.DATA_NIGHT_BEGIN_HOUR, c.DATA_NIGHT_BEGIN_MINUTE),
+    ),
+    c.DATA_NIGHT_END_TIME: (
+        _night_time,
+        (c.DATA_NIGHT_END_HOUR, c.DATA_NIGHT_END_MINUTE),
+    ),
+    c.DATA_NIGHT_LOWERING: (c.NightLoweringState, (c.DATA_NIGHT_LOWERING,)),
+    c.DATA_OPERATION_MODE: (c.OperationMode, (c.DATA_OPERATION_MODE,)),
+    c.DATA_OXYGEN_LEVEL: (_centi, (c.DATA_OXYGEN_LEVEL,)),
+    c.DATA_PHASE: (_burn_phase, (c.DATA_PHASE,)),
+    c.DATA_REFILL_ALARM: (None, (c.DATA_REFILL_ALARM,)),
+    c.DATA_REMOTE_REFILL_ALARM: (None, (c.DATA_REMOTE_REFILL_ALARM,)),
+    c.DATA_REMOTE_VERSION: (
+        _version,
+        (
+            c.DATA_REMOTE_VERSION_MAJOR,
+            c.DATA_REMOTE_VERSION_MINOR,
+            c.DATA_REMOTE_VERSION_BUILD,
+        ),
+    ),
+    c.DATA_ROOM_TEMPERATURE: (_centi, (c.DATA_ROOM_TEMPERATURE,)),
+    c.DATA_SAFETY_ALARMS: (c.SafetyAlarm, (c.DATA_SAFETY_ALARMS,)),
+    c.DATA_STOVE_TEMPERATURE: (_centi, (c.DATA_STOVE_TEMPERATURE,)),
+    c.DATA_TIME_SINCE_REMOTE_MSG: (None, (c.DATA_TIME_SINCE_REMOTE_MSG,)),
+    c.DATA_DATE_TIME: (datetime, _DATETIME_KEYS),
+    c.DATA_TIME_TO_NEW_FIREWOOD: (_time_to_refuel, _REFUEL_KEYS),
+    c.DATA_UPDATING: (None, (c.DATA_UPDATING,)),
+    c.DATA_VALVE1_POSITION: (None, (c.DATA_VALVE1_POSITION,)),
+    c.DATA_VALVE2_POSITION: (None, (c.DATA_VALVE2_POSITION,)),
+    c.DATA_VALVE3_POSITION: (None, (c.DATA_VALVE3_POSITION,)),
+    c.DATA_FIRMWARE_VERSION: (
+        _version,
+        (
+            c.DATA_FIRMWARE_VERSION_MAJOR,
+            c.DATA_FIRMWARE_VERSION_MINOR,
+            c.DATA_FIRMWARE_VERSION_BUILD,
+        ),
+    ),
+}
+
+
+# Per payload: (key, converter, single raw key or None, raw key getter).
+_ROW_CONVERTERS = [
+    (key, convert, keys[0] if len(keys) == 1 else None, itemgetter(*keys))
+    for key, (convert, keys) in FIELD_CONVERTERS.items()
+]
+
+
+def process_raw_data(data):
+    """Process a raw stove data dict as returned by Stove.get_raw_data.
+
+    This does not touch the network and does not modify the input.
+    """
+    result = {}
+    for key, convert, raw_key, getter in _ROW_CONVERTERS:
+        if raw_key is None:
+            result[key] = convert(*getter(data))
+        elif convert is None:
+            result[key] = data[raw_key]
+        else:
+            result[key] = convert(data[raw_key])
+    return result
+
 
 class OpenFileMode(IntEnum):
     """Modes used to open files on the stove."""
@@ -92,107 +302,68 @@ class Stove:
     """Abstraction of a Stove object."""
 
     @classmethod
-    async def create(cls, stove_host, skip_ident=False):
-        """Async create the Stove object."""
+    async def create(
+        cls, stove_host, skip_ident=False, transport=None, rate_limiter=None
+    ):
+        """Async create the Stove object.
+
+        A transport that is passed in is not closed by destroy().
+        """
         self = cls()
         self.stove_host = stove_host
         self.algo_version = None
+        self.mac_address = None
         self.name = None
         self.series = None
         self.stove_ip = None
         self.stove_mdns = None
         self.stove_ssid = None
-        self._session = aiohttp.ClientSession(headers=HTTP_HEADERS)
+        self._owns_transport = transport is None
+        self._transport = transport or HttpTransport()
+        self._capture = None
+        self.rate_limiter = rate_limiter
+        self._raw_data_task = None
+        self._raw_data_started = None
+        self._raw_data_waiters = {}
         if not skip_ident:
             await self._identify()
         return self
 
     async def destroy(self):
-        await self._session.close()
+        self.stop_capture()
+        if self._owns_transport:
+            await self._transport.close()
+
+    def start_capture(self, path):
+        """Record all traffic with the stove to a file at path."""
+        self.stop_capture()
+        self._capture = RecordingTransport(self._transport, path)
+        self._transport = self._capture
+
+    def stop_capture(self):
+        """Stop recording traffic, if a capture is running."""
+        if self._capture is None:
+            return
+        self._transport = self._capture.inner
+        self._capture.close_file()
+        self._capture = None
 
-    async def get_data(self):
+    async def get_data(self, timeout=None):
         """Call get_raw_data, process result before returning."""
-        data = await self.get_raw_data()
-        if data is None:
+        data = await self.get_raw_data(timeout)
+        if not data:
             return
-        phase = c.BurnPhase(
-            data[c.DATA_PHASE] if data[c.DATA_PHASE] not in (2, 3) else 1
-        )
-        stove_datetime = datetime(
-            data[YEAR],
-            data[MONTH],
-            data[DAY],
-            data[HOURS],
-            data[MINUTES],
-            data[SECONDS],
-        )
-        time_to_refuel = timedelta(
-            hours=data[c.DATA_NEW_FIREWOOD_HOURS],
-            minutes=data[c.DATA_NEW_FIREWOOD_MINUTES],
-        )
-        refuel_estimate = stove_datetime + time_to_refuel
-        operation_mode = c.OperationMode(data[c.DATA_OPERATION_MODE])
-        night_lowering = c.NightLoweringState(data[c.DATA_NIGHT_LOWERING])
-        # Stove uses 24:00 for end of day
-        nighttime_start = time(
-            hour=data[c.DATA_NIGHT_BEGIN_HOUR] % 24,
-            minute=data[c.DATA_NIGHT_BEGIN_MINUTE],
-        )
-        nighttime_end = time(
-            hour=data[c.DATA_NIGHT_END_HOUR] % 24, minute=data[c.DATA_NIGHT_END_MINUTE]
-        )
-        stove_version = (
-            f"{data[c.DATA_FIRMWARE_VERSION_MAJOR]}"
-            f".{data[c.DATA_FIRMWARE_VERSION_MINOR]}"
-            f".{data[c.DATA_FIRMWARE_VERSION_BUILD]}"
-        )
-        remote_version = (
-            f"{data[c.DATA_REMOTE_VERSION_MAJOR]}"
-            f".{data[c.DATA_REMOTE_VERSION_MINOR]}"
-            f".{data[c.DATA_REMOTE_VERSION_BUILD]}"
-        )
-        for item in (
-            c.DATA_STOVE_TEMPERATURE,
-            c.DATA_ROOM_TEMPERATURE,
-            c.DATA_OXYGEN_LEVEL,
-        ):
-            data[item] = float(data[item] / 100)
-        processed_data = {
-            c.DATA_ALGORITHM: data[c.DATA_ALGORITHM],
-            c.DATA_BURN_LEVEL: data[c.DATA_BURN_LEVEL],
-            c.DATA_MAINTENANCE_ALARMS: c.MaintenanceAlarm(
-                data[c.DATA_MAINTENANCE_ALARMS]
-            ),
-            c.DATA_MESSAGE_ID: data[c.DATA_MESSAGE_ID],
-            c.DATA_NEW_FIREWOOD_ESTIMATE: refuel_estimate,
-            c.DATA_NIGHT_BEGIN_TIME: nighttime_start,
-            c.DATA_NIGHT_END_TIME: nighttime_end,
-            c.DATA_NIGHT_LOWERING: night_lowering,
-            c.DATA_OPERATION_MODE: operation_mode,
-            c.DATA_OXYGEN_LEVEL: data[c.DATA_OXYGEN_LEVEL],
-            c.DATA_PHASE: phase,
-            c.DATA_REFILL_ALARM: data[c.DATA_REFILL_ALARM],
-            c.DATA_REMOTE_REFILL_ALARM: data[c.DATA_REMOTE_REFILL_ALARM],
-            c.DATA_REMOTE_VERSION: remote_version,
-            c.DATA_ROOM_TEMPERATURE: data[c.DATA_ROOM_TEMPERATURE],
-            c.DATA_SAFETY_ALARMS: c.SafetyAlarm(data[c.DATA_SAFETY_ALARMS]),
-            c.DATA_STOVE_TEMPERATURE: data[c.DATA_STOVE_TEMPERATURE],
-            c.DATA_TIME_SINCE_REMOTE_MSG: data[c.DATA_TIME_SINCE_REMOTE_MSG],
-            c.DATA_DATE_TIME: stove_datetime,
-            c.DATA_TIME_TO_NEW_FIREWOOD: time_to_refuel,
-            c.DATA_UPDATING: data[c.DATA_UPDATING],
-            c.DATA_VALVE1_POSITION: data[c.DATA_VALVE1_POSITION],
-            c.DATA_VALVE2_POSITION: data[c.DATA_VALVE2_POSITION],
-            c.DATA_VALVE3_POSITION: data[c.DATA_VALVE3_POSITION],
-            c.DATA_FIRMWARE_VERSION: stove_version,
-        }
-        return processed_data
+        return process_raw_data(data)
 
-    async def get_live_data(self):
+    async def get_live_data(self, timeout=None):
         """Get 'live' temp and o2 data from the last 2 hours."""
-        bin_arr = bytearray(
-            await self._get("http://" + self.stove_host + STOVE_LIVE_DATA_URL), "utf-8"
-        )
+        with deadline(timeout):
+            response = await self._get(
+                "http://" + self.stove_host + STOVE_LIVE_DATA_URL
+            )
+        if response is None:
+            return
+        bin_arr = bytearray(response, "utf-8")
         response_length = len(bin_arr)
         if response_length % 8 != 0:
             _LOGGER.error("get_live_data got unexpected response from stove.")
@@ -223,9 +394,14 @@ class Stove:
             )
         return data_out
 
-    async def get_raw_data(self):
-        """Request an update from the stove, return raw result."""
-        return await self._get_json("http://" + self.stove_host + STOVE_DATA_URL)
+    async def get_raw_data(self, timeout=None):
+        """Request an update from the stove, return raw result.
+
+        Concurrent calls share a single request to the stove. Returns an
+        empty dict if no response arrived within timeout seconds.
+        """
+        with deadline(timeout):
+            return await self._shared_raw_data()
 
     def self_test(self, delay=3, processed=True):
         """Return self test async generator."""
@@ -234,13 +410,22 @@ class Stove:
     async def set_burn_level(self, burn_level):
         """Set the desired burnlevel."""
         data = {KEY_LEVEL: burn_level}
-        json_str = await self._post(
+        result = await self._post_json(
             "http://" + self.stove_host + STOVE_BURN_LEVEL_URL, data
         )
-        if json_str is None:
-            _LOGGER.error("Got empty or no response from stove.")
+        return result.get(KEY_RESPONSE) == RESPONSE_OK
+
+    async def set_burn_level_and_confirm(self, burn_level, timeout=10):
+        """Set the burn level and wait until the stove reports it.
+
+        Returns the confirming raw data, None if the change was not seen
+        within timeout seconds or False if setting failed.
+        """
+        if not await self.set_burn_level(burn_level):
             return False
-        return json.loads(json_str).get(KEY_RESPONSE) == RESPONSE_OK
+        return await self._confirm(
+            lambda data: data[c.DATA_BURN_LEVEL] == burn_level, timeout
+        )
 
     async def set_night_lowering(self, state=None):
         """Switch/toggle night lowering (True=on, False=off, None=toggle)."""
@@ -250,6 +435,8 @@ class Stove:
             # 2 == On outside night hours
             # 3 == On inside night hours
             # When does night_lowering == 1 happen?
+            if not data:
+                return False
             cur_state = data[c.DATA_NIGHT_LOWERING] > 0
         else:
             cur_state = not state
@@ -257,41 +444,100 @@ class Stove:
         result = await self._get_json("http://" + self.stove_host + url)
         return result.get(KEY_RESPONSE) == RESPONSE_OK
 
+    async def set_night_lowering_and_confirm(self, state=None, timeout=10):
+        """Switch/toggle night lowering and wait until the stove reports it.
+
+        Returns like set_burn_level_and_confirm.
+        """
+        if state is None:
+            data = await self.get_raw_data()
+            if not data:
+                return False
+            state = data[c.DATA_NIGHT_LOWERING] == 0
+        state = bool(state)
+        if not await self.set_night_lowering(state):
+            return False
+        return await self._confirm(
+            lambda data: (data[c.DATA_NIGHT_LOWERING] > 0) == state, timeout
+        )
+
     async def set_night_lowering_hours(self, start=None, end=None):
         """Set night lowering start and end time."""
         if start is None or end is None:
             data = await self.get_data()
-        start = start or data[c.DATA_NIGHT_BEGIN_TIME]
-        end = end or data[c.DATA_NIGHT_END_TIME]
+            if not data:
+                return False
+            start = start or data[c.DATA_NIGHT_BEGIN_TIME]
+            end = end or data[c.DATA_NIGHT_END_TIME]
         data = {
             c.DATA_BEGIN_HOUR: start.hour,
             c.DATA_BEGIN_MINUTE: start.minute,
             c.DATA_END_HOUR: end.hour,
             c.DATA_END_MINUTE: end.minute,
         }
-        json_str = await self._post(
+        result = await self._post_json(
             "http://" + self.stove_host + STOVE_NIGHT_TIME_URL, data
         )
-        if json_str is None:
-            _LOGGER.error("Got empty or no response from stove.")
+        return result.get(KEY_RESPONSE) == RESPONSE_OK
+
+    async def set_night_lowering_hours_and_confirm(
+        self, start=None, end=None, timeout=10
+    ):
+        """Set night lowering hours and wait until the stove reports them.
+
+        Returns like set_burn_level_and_confirm.
+        """
+        if start is None or end is None:
+            data = await self.get_data()
+            if not data:
+                return False
+            start = start or data[c.DATA_NIGHT_BEGIN_TIME]
+            end = end or data[c.DATA_NIGHT_END_TIME]
+        if not await self.set_night_lowering_hours(start, end):
             return False
-        return json.loads(json_str).get(KEY_RESPONSE) == RESPONSE_OK
+
+        def confirmed(data):
+            # Stove uses 24:00 for end of day
+            return (
+                data[c.DATA_NIGHT_BEGIN_HOUR] % 24 == start.hour
+                and data[c.DATA_NIGHT_BEGIN_MINUTE] == start.minute
+                and data[c.DATA_NIGHT_END_HOUR] % 24 == end.hour
+                and data[c.DATA_NIGHT_END_MINUTE] == end.minute
+            )
+
+        return await self._confirm(confirmed, timeout)
 
     async def set_remote_refill_alarm(self, state=None):
         """Set or toggle remote_refill_alarm setting."""
         if state is None:
             data = await self.get_raw_data()
+            if not data:
+                return False
             cur_state = data[c.DATA_REMOTE_REFILL_ALARM] == 1
         else:
             cur_state = not state
         data = {KEY_ENABLE: 0 if cur_state else 1}
-        json_str = await self._post(
+        result = await self._post_json(
             "http://" + self.stove_host + STOVE_REMOTE_REFILL_ALARM_URL, data
         )
-        if json_str is None:
-            _LOGGER.error("Got empty or no response from stove.")
+        return result.get(KEY_RESPONSE) == RESPONSE_OK
+
+    async def set_remote_refill_alarm_and_confirm(self, state=None, timeout=10):
+        """Set or toggle remote_refill_alarm and wait until the stove reports it.
+
+        Returns like set_burn_level_and_confirm.
+        """
+        if state is None:
+            data = await self.get_raw_data()
+            if not data:
+                return False
+            state = data[c.DATA_REMOTE_REFILL_ALARM] != 1
+        state = bool(state)
+        if not await self.set_remote_refill_alarm(state):
             return False
-        return json.loads(json_str).get(KEY_RESPONSE) == RESPONSE_OK
+        return await self._confirm(
+            lambda data: data[c.DATA_REMOTE_REFILL_ALARM] == int(state), timeout
+        )
 
     async def set_time(self, new_time=None):
         """Set the time and date of the stove."""
@@ -305,13 +551,30 @@ class Stove:
             MINUTES: new_time.minute,
             SECONDS: new_time.second,
         }
-        json_str = await self._post(
+        result = await self._post_json(
             "http://" + self.stove_host + STOVE_SET_TIME_URL, data
         )
-        if json_str is None:
-            _LOGGER.error("Got empty or no response from stove.")
+        return result.get(KEY_RESPONSE) == RESPONSE_OK
+
+    async def set_time_and_confirm(self, new_time=None, timeout=10, tolerance=2):
+        """Set the stove time and wait until the stove reports it.
+
+        The reported time must be within tolerance seconds of new_time
+        plus the time passed since setting it. Returns like
+        set_burn_level_and_confirm.
+        """
+        if new_time is None:
+            new_time = datetime.now()
+        if not await self.set_time(new_time):
             return False
-        return json.loads(json_str).get(KEY_RESPONSE) == RESPONSE_OK
+        loop = asyncio.get_running_loop()
+        set_at = loop.time()
+
+        def confirmed(data):
+            expected = new_time + timedelta(seconds=loop.time() - set_at)
+            return abs(raw_datetime(data) - expected) <= timedelta(seconds=tolerance)
+
+        return await self._confirm(confirmed, timeout)
 
     async def start(self):
         """Start the ignition phase."""
@@ -319,22 +582,60 @@ class Stove:
         return result.get(KEY_RESPONSE) == RESPONSE_OK
 
     async def write_text_file(self, filename, text):
-        async with _StoveWritableFile(self, filename) as f:
-            await f.write_text(text)
+        await self.write_binary_file(filename, text.encode("utf-8"))
 
     async def write_binary_file(self, filename, data):
+        await self.write_packed_file(filename, pack_blocks(data))
+
+    async def write_packed_file(self, filename, blocks):
+        """Write blocks packed by pack_blocks to a file.
+
+        Useful to write the same data to many stoves without packing it
+        for each of them.
+        """
         async with _StoveWritableFile(self, filename) as f:
-            await f.write_binary(data)
+            for request in blocks:
+                await f.write_packed(request)
+
+    async def sync_text_file(self, filename, text):
+        """Write only the blocks of text that differ from the stove's file."""
+        return await self.sync_binary_file(filename, text.encode("utf-8"))
+
+    async def sync_binary_file(self, filename, data):
+        """Write only the blocks of data that differ from the stove's file.
+
+        Returns the number of blocks written.
+        """
+        try:
+            async with _StoveFile(self, filename) as f:
+                current = await f.read()
+            current = None if current is None else current.encode("utf-8")
+        except (c.FileOpenFailedError, UnicodeDecodeError):
+            current = None
+        offsets = range(0, len(data), FILE_BLOCK_SIZE)
+        if current is not None and len(current) > len(data):
+            # The stove does not truncate on open, the old tail would remain.
+            await self.delete_file(filename)
+        elif current is not None:
+            offsets = [
+                offset
+                for offset in offsets
+                if data[offset : offset + FILE_BLOCK_SIZE]
+                != current[offset : offset + FILE_BLOCK_SIZE]
+            ]
+        if not offsets:
+            return 0
+        async with _StoveWritableFile(self, filename) as f:
+            for offset in offsets:
+                await f.write_binary(data[offset : offset + FILE_BLOCK_SIZE], offset)
+        return len(offsets)
 
     async def delete_file(self, filename):
-        json_str = await self._post(
-            "http://" + self.stove_host + STOVE_NIGHT_TIME_URL,
-            {c.DATA_FILENAME: filename},
+        result = await self._post_json(
+            "http://" + self.stove_host + STOVE_DELETE_FILE_URL,
+            {FILE_NAME: filename},
         )
-        if json_str is None:
-            _LOGGER.error("Got empty or no response from stove.")
-            return False
-        return json.loads(json_str).get(KEY_RESPONSE) == RESPONSE_OK
+        return result.get(KEY_RESPONSE) == RESPONSE_OK
 
     async def _identify(self):
         """Get identification and set the properties on the object."""
@@ -358,7 +659,7 @@ class Stove:
 
             if IDENT_MDNS in stove_id:
                 self.stove_mdns = stove_id[IDENT_MDNS]
-                self.mac_address = int(self.stove_mdns[-12:], 16) & 0xFDFFFFFFFFFF
+                self.mac_address = mac_from_mdns(self.stove_mdns)
 
             else:
                 _LOGGER.warning("Unable to read stove MDNS.")
@@ -395,6 +696,70 @@ class Stove:
             ]
         )
 
+    async def _shared_raw_data(self, since=None):
+        """Get raw data, sharing a request that is already in flight.
+
+        If since is given, only a request started at or after that loop
+        time is shared. Every caller waits until its own deadline, the
+        request is cancelled when no caller is waiting for it anymore.
+        """
+        if _expired():
+            _LOGGER.error("Deadline passed, not requesting data from stove.")
+            return {}
+        task = self._raw_data_task
+        if task is None or (since is not None and self._raw_data_started < since):
+            self._raw_data_started = asyncio.get_running_loop().time()
+            task = self._raw_data_task = asyncio.ensure_future(self._fetch_raw_data())
+
+            def done(task):
+                if self._raw_data_task is task:
+                    self._raw_data_task = None
+
+            task.add_done_callback(done)
+        self._raw_data_waiters[task] = self._raw_data_waiters.get(task, 0) + 1
+        try:
+            async with asyncio.timeout_at(_deadline.get()):
+                data = await asyncio.shield(task)
+        except TimeoutError:
+            _LOGGER.error("Request to stove timed out.")
+            return {}
+        finally:
+            self._raw_data_waiters[task] -= 1
+            if not self._raw_data_waiters[task]:
+                del self._raw_data_waiters[task]
+                if not task.done():
+                    task.cancel()
+                    if self._raw_data_task is task:
+                        self._raw_data_task = None
+        # Every caller gets its own copy
+        return dict(data)
+
+    async def _fetch_raw_data(self):
+        """Get raw data for _shared_raw_data."""
+        # The callers apply their own deadlines.
+        _deadline.set(None)
+        return await self._get_json("http://" + self.stove_host + STOVE_DATA_URL)
+
+    async def _confirm(self, predicate, timeout):
+        """Poll raw data until predicate(data) is true or timeout passes.
+
+        Returns the matching raw data or None.
+        """
+        since = asyncio.get_running_loop().time()
+        delay = 0.2
+        try:
+            # Also bounds a poll that is still running when timeout passes.
+            async with asyncio.timeout_at(since + timeout):
+                while True:
+                    data = await self._shared_raw_data(since)
+                    if data and predicate(data):
+                        return data
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 2)
+        except TimeoutError:
+            _LOGGER.warning("Stove did not confirm change within %ss.", timeout)
+            return None
+
     async def _self_test_result(self):
         """Get self test result."""
         count = 0
@@ -404,14 +769,13 @@ class Stove:
             result = await self._get_json(
                 "http://" + self.stove_host + STOVE_SELFTEST_RESULT_URL
             )
-            if result == {}:
-                continue
-            if not result.get("reponse"):  # NOT A TYPO!!!
+            if result and not result.get("reponse"):  # NOT A TYPO!!!
                 break
             if count >= 3:
                 return
             count = count + 1
-            await asyncio.sleep(3)
+            if result:
+                await asyncio.sleep(3)
         return result
 
     async def _self_test_start(self):
@@ -423,8 +787,16 @@ class Stove:
 
     async def _get_json(self, url):
         """Get data from url, interpret as json, return result."""
-        json_str = await self._get(url)
-        if json_str is None:
+        return self._decode_json(await self._get(url))
+
+    async def _post_json(self, url, data):
+        """Post data to url, interpret response as json, return result."""
+        return self._decode_json(await self._post(url, data))
+
+    @staticmethod
+    def _decode_json(json_str):
+        """Decode a json response, return {} if it is missing or invalid."""
+        if not json_str:
             _LOGGER.error("Got empty or no response from stove.")
             return {}
         try:
@@ -433,25 +805,61 @@ class Stove:
             _LOGGER.error("Could not decode received data as json: %s", exc.doc)
             _LOGGER.error("Error was: %s", exc.msg)
             return {}
+        if not isinstance(result, dict):
+            _LOGGER.error("Unexpected response from stove: %s", json_str)
+            return {}
         return result
 
     async def _get(self, url):
         """Get data from url, return response."""
+        if _expired():
+            _LOGGER.error("Deadline passed, not sending request to stove.")
+            return None
         try:
-            async with self._session.get(url) as response:
-                return await response.text()
-        except ClientConnectorError:
+            async with asyncio.timeout_at(_deadline.get()):
+                await self._rate_limit(url)
+                return await self._transport.get(url)
+        except aiohttp.ClientConnectionError:
             _LOGGER.error("Could not connect to stove.")
+        except TimeoutError:
+            _LOGGER.error("Request to stove timed out.")
 
     async def _post(self, url, data):
         """Post data to url, return response."""
+        if _expired():
+            _LOGGER.error("Deadline passed, not sending request to stove.")
+            return None
         try:
-            async with self._session.post(
-                url, data=json.dumps(data, separators=(",", ":"))
-            ) as response:
-                return await response.text()
-        except ClientConnectorError:
+            async with asyncio.timeout_at(_deadline.get()):
+                await self._rate_limit(url)
+                return await self._transport.post(
+                    url, json.dumps(data, separators=(",", ":"))
+                )
+        except aiohttp.ClientConnectionError:
             _LOGGER.error("Could not connect to stove.")
+        except TimeoutError:
+            _LOGGER.error("Request to stove timed out.")
+
+    async def _rate_limit(self, url):
+        """Wait for the rate limiter, if any."""
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(write=urlsplit(url).path in WRITE_URLS)
+
+    async def _write(self, request):
+        """Send a raw request to the stove, return the response bytes.
+
+        Returns None if the deadline passed.
+        """
+        if _expired():
+            _LOGGER.error("Deadline passed, not sending request to stove.")
+            return None
+        try:
+            async with asyncio.timeout_at(_deadline.get()):
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(write=True)
+                return await self._transport.write(self.stove_host, request)
+        except TimeoutError:
+            _LOGGER.error("Request to stove timed out.")
 
 
 class _SelfTest:
@@ -519,18 +927,32 @@ class _StoveFile:
                 self.base_url + STOVE_OPEN_FILE_URL, self.data
             )
             if json_str is None:
-                raise ClientConnectorError
-            response_data = json.loads(json_str)
+                raise c.FileOpenFailedError
+            try:
+                response_data = json.loads(json_str)
+            except json.JSONDecodeError as exc:
+                raise c.FileOpenFailedError from exc
             if response_data.get(RESPONSE_SUCCESS) != 1:
                 raise c.FileOpenFailedError
             self.file_size = response_data.get(FILE_SIZE)
             return self
-        except (ClientConnectorError, c.FileOpenFailedError):
-            await self.stove._get(self.base_url + STOVE_CLOSE_FILE_URL)
+        except (c.FileOpenFailedError, asyncio.CancelledError):
+            await self._close()
             raise
 
     async def __aexit__(self, *args):
         """Close the file."""
+        await self._close()
+
+    async def _close(self):
+        """Close the file, even if the deadline passed or we are cancelled."""
+        task = asyncio.ensure_future(self._close_file())
+        _cleanup_tasks.add(task)
+        task.add_done_callback(_cleanup_tasks.discard)
+        await asyncio.shield(task)
+
+    async def _close_file(self):
+        _deadline.set(asyncio.get_running_loop().time() + CLEANUP_TIMEOUT)
         await self.stove._get(self.base_url + STOVE_CLOSE_FILE_URL)
 
     async def read(self):
@@ -548,33 +970,14 @@ class _StoveWritableFile(_StoveFile):
 
     async def write_text(self, text, offset=0):
         """Write text to the file."""
-        await self.write_binary(text.encode("utf-8", offset))
+        await self.write_binary(text.encode("utf-8"), offset)
 
     async def write_binary(self, data, offset=0):
         """Write data to the file."""
-        # write_open_file expects binary data:
-        # uint16 Size of binary data;
-        # uint32 Offset to write to;
-        # uint8[1024] data
-        data_length = len(data)
-        if data_length > 1024:
-            raise RuntimeError("Data too long (>1024 bytes)")
-        size = 2 + 4 + data_length
-        byte_array = struct.pack(f"<HI{data_length}s", size, offset, data)
+        await self.write_packed(pack_block(data, offset))
 
-        try:
-            reader, writer = await asyncio.open_connection(self.stove.stove_host, 80)
-            request_string = (
-                f"POST {STOVE_WRITE_OPEN_FILE_URL} HTTP/1.1 \r\n"
-                f"content-length: {data_length} \r\n"
-                "Content-Type: binary \r\n"
-                "\r\n"
-            )
-            writer.write(request_string.encode("utf-8"))
-            writer.write(byte_array)
-            await writer.drain()
-            response = await reader.read(2)
-            if response != b"OK":
-                raise c.FileWriteFailedError
-        finally:
-            writer.close()
+    async def write_packed(self, request):
+        """Write a block packed by pack_block to the file."""
+        response = await self.stove._write(request)
+        if response != b"OK":
+            raise c.FileWriteFailedError
@@ -0,0 +1,117 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+import time
+
+KIND_READ = "read"
+KIND_WRITE = "write"
+
+STAT_CANCELLED = "cancelled"
+STAT_DELAYED = "delayed"
+STAT_MAX_WAIT = "max_wait"
+STAT_REQUESTS = "requests"
+STAT_TOTAL_WAIT = "total_wait"
+
+_limiters = {}
+
+
+class TokenBucket:
+    """Token bucket allowing rate requests per second with bursts of burst.
+
+    Tokens are reserved on acquire, so concurrent callers are delayed in
+    the order in which they arrive.
+    """
+
+    def __init__(self, rate, burst):
+        """Initialize a full bucket."""
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def reserve(self):
+        """Take a token, return the number of seconds to wait for it."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    async def acquire(self):
+        """Wait for a token, return the number of seconds waited.
+
+        The token is returned if the wait is cancelled.
+        """
+        wait = self.reserve()
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self._tokens += 1
+                raise
+        return wait
+
+
+class RateLimiter:
+    """Separate read and write token buckets for one stove, with metrics."""
+
+    def __init__(self, read_rate=4.0, read_burst=8, write_rate=1.0, write_burst=2):
+        """Initialize the limiter."""
+        self.buckets = {
+            KIND_READ: TokenBucket(read_rate, read_burst),
+            KIND_WRITE: TokenBucket(write_rate, write_burst),
+        }
+        self.stats = {
+            kind: {
+                STAT_REQUESTS: 0,
+                STAT_CANCELLED: 0,
+                STAT_DELAYED: 0,
+                STAT_TOTAL_WAIT: 0.0,
+                STAT_MAX_WAIT: 0.0,
+            }
+            for kind in self.buckets
+        }
+
+    async def acquire(self, write=False):
+        """Wait until a read or write request may be sent."""
+        kind = KIND_WRITE if write else KIND_READ
+        stats = self.stats[kind]
+        try:
+            wait = await self.buckets[kind].acquire()
+        except asyncio.CancelledError:
+            stats[STAT_CANCELLED] += 1
+            raise
+        stats[STAT_REQUESTS] += 1
+        if wait:
+            stats[STAT_DELAYED] += 1
+            stats[STAT_TOTAL_WAIT] += wait
+            stats[STAT_MAX_WAIT] = max(stats[STAT_MAX_WAIT], wait)
+        return wait
+
+
+def limiter_for_host(host, **kwargs):
+    """Return the RateLimiter shared by all users of host.
+
+    The limiter is created with kwargs on first use.
+    """
+    if host not in _limiters:
+        _limiters[host] = RateLimiter(**kwargs)
+    return _limiters[host]
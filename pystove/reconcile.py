@@ -0,0 +1,254 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+from datetime import datetime, time
+import logging
+
+import aiohttp
+
+from . import const as c
+from .pystove import raw_datetime
+
+_LOGGER = logging.getLogger(__name__)
+
+ACTION_BURN_LEVEL = "burn_level"
+ACTION_CLOCK = "clock"
+ACTION_NIGHT_LOWERING = "night_lowering"
+ACTION_NIGHT_LOWERING_HOURS = "night_lowering_hours"
+ACTION_REMOTE_REFILL_ALARM = "remote_refill_alarm"
+
+_FIELDS = (
+    "burn_level",
+    "night_lowering",
+    "night_begin",
+    "night_end",
+    "remote_refill_alarm",
+    "clock_tolerance",
+)
+
+
+class DesiredState:
+    """Desired settings of a stove. Settings left at None are not managed.
+
+    Set clock_tolerance to a timedelta to correct stove clocks that are
+    further off than that.
+    """
+
+    def __init__(
+        self,
+        burn_level=None,
+        night_lowering=None,
+        night_begin=None,
+        night_end=None,
+        remote_refill_alarm=None,
+        clock_tolerance=None,
+    ):
+        """Initialize the desired state."""
+        self.burn_level = burn_level
+        self.night_lowering = night_lowering
+        self.night_begin = night_begin
+        self.night_end = night_end
+        self.remote_refill_alarm = remote_refill_alarm
+        self.clock_tolerance = clock_tolerance
+
+    def merged(self, other):
+        """Return a new state with the settings of other taking precedence."""
+        return DesiredState(
+            **{
+                field: getattr(other, field)
+                if getattr(other, field) is not None
+                else getattr(self, field)
+                for field in _FIELDS
+            }
+        )
+
+
+class Action:
+    """A single setter call needed to reach the desired state."""
+
+    def __init__(self, name, current, desired, call):
+        """Initialize the action, call is a coroutine function."""
+        self.name = name
+        self.current = current
+        self.desired = desired
+        self.call = call
+
+    def __repr__(self):
+        return f"<Action {self.name}: {self.current!r} -> {self.desired!r}>"
+
+
+class ReconcileResult:
+    """Planned actions of a stove and the outcome of applying them."""
+
+    def __init__(self, stove):
+        """Initialize an empty result for stove."""
+        self.stove = stove
+        self.actions = []
+        self.applied = {}
+        self.error = None
+
+    @property
+    def success(self):
+        """Return whether the plan was made and all applied actions succeeded."""
+        return self.error is None and all(self.applied.values())
+
+    def __repr__(self):
+        return (
+            f"<ReconcileResult {self.stove.stove_host} actions={self.actions}"
+            f" applied={self.applied} error={self.error}>"
+        )
+
+
+def plan(stove, data, desired, now=None):
+    """Return the list of Actions that bring raw data to the desired state."""
+    actions = []
+    if desired.burn_level is not None:
+        current = data[c.DATA_BURN_LEVEL]
+        if current != desired.burn_level:
+            actions.append(
+                Action(
+                    ACTION_BURN_LEVEL,
+                    current,
+                    desired.burn_level,
+                    lambda: stove.set_burn_level(desired.burn_level),
+                )
+            )
+    if desired.night_lowering is not None:
+        current = data[c.DATA_NIGHT_LOWERING] > 0
+        if current != bool(desired.night_lowering):
+            actions.append(
+                Action(
+                    ACTION_NIGHT_LOWERING,
+                    current,
+                    bool(desired.night_lowering),
+                    lambda: stove.set_night_lowering(bool(desired.night_lowering)),
+                )
+            )
+    if desired.night_begin is not None or desired.night_end is not None:
+        # Stove uses 24:00 for end of day
+        current = (
+            time(data[c.DATA_NIGHT_BEGIN_HOUR] % 24, data[c.DATA_NIGHT_BEGIN_MINUTE]),
+            time(data[c.DATA_NIGHT_END_HOUR] % 24, data[c.DATA_NIGHT_END_MINUTE]),
+        )
+        target = (desired.night_begin or current[0], desired.night_end or current[1])
+        if current != target:
+            actions.append(
+                Action(
+                    ACTION_NIGHT_LOWERING_HOURS,
+                    current,
+                    target,
+                    lambda: stove.set_night_lowering_hours(*target),
+                )
+            )
+    if desired.remote_refill_alarm is not None:
+        current = data[c.DATA_REMOTE_REFILL_ALARM] == 1
+        if current != bool(desired.remote_refill_alarm):
+            actions.append(
+                Action(
+                    ACTION_REMOTE_REFILL_ALARM,
+                    current,
+                    bool(desired.remote_refill_alarm),
+                    lambda: stove.set_remote_refill_alarm(
+                        bool(desired.remote_refill_alarm)
+                    ),
+                )
+            )
+    if desired.clock_tolerance is not None:
+        now = now or datetime.now()
+        current = raw_datetime(data)
+        if abs(current - now) > desired.clock_tolerance:
+            actions.append(Action(ACTION_CLOCK, current, now, lambda: stove.set_time()))
+    return actions
+
+
+def resolve(host, desired, groups=None):
+    """Return the DesiredState of host.
+
+    Desired maps hosts and group names to DesiredState objects, groups
+    maps hosts to a list of group names. Group states are merged in
+    order, the state of the host itself takes precedence.
+    """
+    state = DesiredState()
+    for group in (groups or {}).get(host, ()):
+        if group in desired:
+            state = state.merged(desired[group])
+    if host in desired:
+        state = state.merged(desired[host])
+    return state
+
+
+async def reconcile(stoves, desired, groups=None, dry_run=False, concurrency=16):
+    """Bring stoves to their desired state with as few writes as possible.
+
+    The current state of every stove is read once. Stoves are handled
+    concurrently, the actions of a single stove one at a time. With
+    dry_run, only the planned actions are returned. Returns a list of
+    ReconcileResult in the order of stoves. A failing stove does not
+    affect the others, its error is recorded in its result.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(stove):
+        result = ReconcileResult(stove)
+        async with semaphore:
+            try:
+                data = await stove.get_raw_data()
+            except (aiohttp.ClientError, OSError, ValueError) as exc:
+                _LOGGER.exception("%s: reading state failed.", stove.stove_host)
+                result.error = f"Reading state failed: {exc!r}"
+                return result
+            if not data:
+                result.error = "No response from stove"
+                return result
+            state = resolve(stove.stove_host, desired, groups)
+            result.actions = plan(stove, data, state)
+            if dry_run:
+                return result
+            for action in result.actions:
+                try:
+                    result.applied[action.name] = await action.call()
+                except (aiohttp.ClientError, OSError, ValueError) as exc:
+                    _LOGGER.exception(
+                        "%s: setting %s failed.", stove.stove_host, action.name
+                    )
+                    result.applied[action.name] = False
+                    result.error = f"Setting {action.name} failed: {exc!r}"
+                    continue
+                if not result.applied[action.name]:
+                    _LOGGER.warning(
+                        "%s: setting %s failed.", stove.stove_host, action.name
+                    )
+        return result
+
+    return await asyncio.gather(*[run(stove) for stove in stoves])
+
+
+def format_diff(results):
+    """Return a human readable diff of reconcile results."""
+    lines = []
+    for result in results:
+        for action in result.actions:
+            line = f"{result.stove.stove_host}: {action.name}: "
+            line += f"{action.current} -> {action.desired}"
+            if action.name in result.applied:
+                line += " (ok)" if result.applied[action.name] else " (failed)"
+            lines.append(line)
+        if result.error:
+            lines.append(f"{result.stove.stove_host}: {result.error}")
+    return "\n".join(lines)
@@ -0,0 +1,174 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+import base64
+from collections import defaultdict, deque
+import gzip
+import json
+import logging
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+_LOGGER = logging.getLogger(__name__)
+
+# Recording file format: gzip compressed, one JSON object per line.
+REC_BODY = "b"
+REC_DURATION = "d"
+REC_ERROR = "e"
+REC_METHOD = "m"
+REC_RESPONSE = "r"
+REC_START = "t"
+REC_URL = "u"
+
+METHOD_GET = "GET"
+METHOD_POST = "POST"
+METHOD_WRITE = "WRITE"
+
+
+def _url_path(url):
+    """Strip scheme and host from url, so recordings are host independent."""
+    parts = urlsplit(url)
+    return parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+def _encode_bytes(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+class RecordingTransport:
+    """Transport wrapper that records all traffic to a file."""
+
+    def __init__(self, inner, path):
+        """Initialize the recorder around inner transport."""
+        self.inner = inner
+        self._file = gzip.open(path, "wt", encoding="utf-8")  # noqa: SIM115
+        self._t0 = time.monotonic()
+
+    async def get(self, url):
+        """Get data from url, record the exchange."""
+        return await self._record(METHOD_GET, _url_path(url), None, self.inner.get(url))
+
+    async def post(self, url, body):
+        """Post body to url, record the exchange."""
+        return await self._record(
+            METHOD_POST, _url_path(url), body, self.inner.post(url, body)
+        )
+
+    async def write(self, host, request):
+        """Send a raw request to host, record the exchange."""
+        response = await self._record(
+            METHOD_WRITE,
+            None,
+            _encode_bytes(request),
+            self._write_encoded(host, request),
+        )
+        return None if response is None else base64.b64decode(response)
+
+    async def _write_encoded(self, host, request):
+        response = await self.inner.write(host, request)
+        return None if response is None else _encode_bytes(response)
+
+    async def _record(self, method, url, body, coro):
+        start = time.monotonic()
+        entry = {REC_START: round(start - self._t0, 4), REC_METHOD: method}
+        if url is not None:
+            entry[REC_URL] = url
+        if body is not None:
+            entry[REC_BODY] = body
+        try:
+            response = await coro
+        except (aiohttp.ClientConnectionError, OSError):
+            entry[REC_ERROR] = 1
+            raise
+        else:
+            entry[REC_RESPONSE] = response
+            return response
+        finally:
+            entry[REC_DURATION] = round(time.monotonic() - start, 4)
+            if not self._file.closed:
+                self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    async def close(self):
+        """Close the recording file."""
+        self.close_file()
+
+    def close_file(self):
+        """Close the recording file."""
+        self._file.close()
+
+
+class ReplayTransport:
+    """Transport that serves responses from a recording.
+
+    Requests are matched on method, path and body and served in recorded
+    order. The replay clock starts at the first request. Each response is
+    served when it arrived in the recording, with times divided by speed,
+    so the gaps between requests are reproduced as well as the response
+    latency. A request that comes later than recorded still waits its
+    recorded duration. A speed of None serves responses immediately.
+    """
+
+    def __init__(self, path, speed=1.0):
+        """Load the recording at path."""
+        self.speed = speed
+        self._entries = defaultdict(deque)
+        self._first_start = None
+        self._t0 = None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                key = (entry[REC_METHOD], entry.get(REC_URL), entry.get(REC_BODY))
+                self._entries[key].append(entry)
+                if self._first_start is None:
+                    self._first_start = entry[REC_START]
+
+    async def get(self, url):
+        """Serve a recorded get response."""
+        return await self._replay(METHOD_GET, _url_path(url), None)
+
+    async def post(self, url, body):
+        """Serve a recorded post response."""
+        return await self._replay(METHOD_POST, _url_path(url), body)
+
+    async def write(self, host, request):
+        """Serve a recorded raw write response."""
+        response = await self._replay(METHOD_WRITE, None, _encode_bytes(request))
+        return None if response is None else base64.b64decode(response)
+
+    async def _replay(self, method, url, body):
+        entries = self._entries.get((method, url, body))
+        if not entries:
+            _LOGGER.error("No recorded response for %s %s", method, url)
+            raise aiohttp.ClientConnectionError("No recorded response")
+        entry = entries.popleft()
+        if self.speed:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._t0 is None:
+                self._t0 = now - self._first_start / self.speed
+            due = self._t0 + (entry[REC_START] + entry[REC_DURATION]) / self.speed
+            await asyncio.sleep(max(due - now, entry[REC_DURATION] / self.speed))
+        if entry.get(REC_ERROR):
+            raise aiohttp.ClientConnectionError("Recorded connection failure")
+        return entry.get(REC_RESPONSE)
+
+    async def close(self):
+        """Nothing to clean up."""
@@ -0,0 +1,231 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import zlib
+
+import aiohttp
+
+from .pystove import Stove, deadline
+from .transport import HTTP_HEADERS, HttpTransport
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def shard_for(host, shards):
+    """Return the shard index of host, stable across processes and runs."""
+    return zlib.crc32(host.encode("utf-8")) % shards
+
+
+async def _poll_shard(hosts, results, stop, interval, concurrency, raw, cycles):
+    """Poll hosts until stop is set, put one batch per cycle on results."""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(
+        headers=HTTP_HEADERS, connector=connector
+    ) as session:
+        transport = HttpTransport(session)
+        stoves = [
+            await Stove.create(host, skip_ident=True, transport=transport)
+            for host in hosts
+        ]
+
+        async def poll(stove):
+            async with semaphore:
+                try:
+                    if raw:
+                        return await stove.get_raw_data() or None
+                    return await stove.get_data()
+                except Exception:  # noqa: BLE001
+                    _LOGGER.exception("%s: polling failed.", stove.stove_host)
+                    return None
+
+        cycle = 0
+        dropped = 0
+        while not stop.is_set() and (cycles is None or cycle < cycles):
+            start = time.monotonic()
+            # Requests still running at the next cycle are cancelled.
+            with deadline(interval or None):
+                data = await asyncio.gather(*[poll(stove) for stove in stoves])
+            batch = (os.getpid(), time.time(), list(zip(hosts, data, strict=True)))
+            # Never block the event loop on a parent that falls behind.
+            try:
+                results.put_nowait(batch)
+            except queue.Full:
+                dropped += 1
+                _LOGGER.warning("Result queue full, dropped %d batches.", dropped)
+            cycle += 1
+            delay = interval - (time.monotonic() - start)
+            if delay > 0:
+                await loop.run_in_executor(None, stop.wait, delay)
+        for stove in stoves:
+            await stove.destroy()
+
+
+def _worker(hosts, results, stop, interval, concurrency, raw, cycles):
+    """Entry point of a worker process."""
+    try:
+        asyncio.run(
+            _poll_shard(hosts, results, stop, interval, concurrency, raw, cycles)
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Tell the parent this worker is done.
+        results.put(os.getpid())
+
+
+class ShardedPoller:
+    """Poll a large fleet of stoves from a pool of worker processes.
+
+    Hosts are hashed to shards, every shard is polled by its own process
+    with its own event loop and connection pool. Every poll cycle a worker
+    sends a single pickled batch of (host, data) tuples to the parent, data
+    is None for stoves that did not respond. With raw, workers send raw
+    data instead of processed data.
+    """
+
+    def __init__(
+        self,
+        hosts,
+        processes=None,
+        interval=10.0,
+        concurrency=64,
+        raw=False,
+        cycles=None,
+        max_batches=1024,
+    ):
+        """Initialize the poller, processes defaults to the number of CPUs."""
+        processes = min(processes or os.cpu_count() or 1, len(hosts)) or 1
+        self.shards = [[] for _ in range(processes)]
+        for host in hosts:
+            self.shards[shard_for(host, processes)].append(host)
+        self.interval = interval
+        self.concurrency = concurrency
+        self.raw = raw
+        self.cycles = cycles
+        # Spawn rather than fork, the parent may run an event loop.
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue(max_batches)
+        self._stop = self._context.Event()
+        self._processes = []
+        self._finished = set()
+        self._running = 0
+
+    def start(self):
+        """Start the worker processes."""
+        for hosts in self.shards:
+            if not hosts:
+                continue
+            process = self._context.Process(
+                target=_worker,
+                args=(
+                    hosts,
+                    self._results,
+                    self._stop,
+                    self.interval,
+                    self.concurrency,
+                    self.raw,
+                    self.cycles,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        self._finished = set()
+        self._running = len(self._processes)
+
+    def stop(self, timeout=5.0):
+        """Stop the worker processes, terminate those that do not exit."""
+        self._stop.set()
+        # Drain the queue, workers can not exit while their batches are
+        # still buffered.
+        stop_by = time.monotonic() + timeout
+        while self._running and time.monotonic() < stop_by:
+            self.get_batch(timeout=0.1)
+        for process in self._processes:
+            process.join(max(stop_by - time.monotonic(), 0))
+            if process.is_alive():
+                _LOGGER.warning("Terminating worker %s.", process.pid)
+                process.terminate()
+                process.join()
+        self._processes = []
+        self._running = 0
+
+    @property
+    def running(self):
+        """Return whether any worker is still sending batches."""
+        self._reap()
+        return self._running > 0
+
+    def get_batch(self, timeout=None):
+        """Return the next (pid, timestamp, results) batch.
+
+        Returns None on timeout or when all workers have finished. Workers
+        that died without saying so are noticed while waiting.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while self._running:
+            wait = 1.0 if end is None else max(min(end - time.monotonic(), 1.0), 0)
+            try:
+                batch = self._results.get(timeout=wait)
+            except queue.Empty:
+                self._reap()
+                if end is not None and time.monotonic() >= end:
+                    return None
+                continue
+            if isinstance(batch, tuple):
+                return batch
+            self._finish(batch)
+        return None
+
+    def _finish(self, pid):
+        if pid not in self._finished:
+            self._finished.add(pid)
+            self._running -= 1
+
+    def _reap(self):
+        """Finish workers that died, they never send their pid."""
+        for process in self._processes:
+            if process.pid in self._finished or process.exitcode in (None, 0):
+                continue
+            _LOGGER.warning(
+                "Worker %s died with exit code %s.", process.pid, process.exitcode
+            )
+            self._finish(process.pid)
+
+    async def batches(self):
+        """Asynchronously yield batches until all workers have finished."""
+        loop = asyncio.get_running_loop()
+        while self._running:
+            batch = await loop.run_in_executor(None, self.get_batch, 0.5)
+            if batch is not None:
+                yield batch
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,379 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+from datetime import datetime, timedelta
+import json
+import logging
+import struct
+
+from . import const as c
+from .mqtt import (
+    PACKET_CONNACK,
+    PACKET_CONNECT,
+    PACKET_DISCONNECT,
+    PACKET_PINGREQ,
+    PACKET_PINGRESP,
+    PACKET_PUBLISH,
+    PUBLISH_RETAIN,
+    read_packet,
+)
+from .pystove import (
+    DAY,
+    FILE_MODE,
+    FILE_NAME,
+    FILE_SIZE,
+    FILENAME_INFO,
+    HOURS,
+    IDENT_IP,
+    IDENT_MDNS,
+    IDENT_NAME,
+    IDENT_SSID,
+    KEY_ENABLE,
+    KEY_LEVEL,
+    KEY_RESPONSE,
+    MINUTES,
+    MONTH,
+    RESPONSE_OK,
+    RESPONSE_SUCCESS,
+    SECONDS,
+    STOVE_ACCESSPOINT_URL,
+    STOVE_BURN_LEVEL_URL,
+    STOVE_CLOSE_FILE_URL,
+    STOVE_DATA_URL,
+    STOVE_DELETE_FILE_URL,
+    STOVE_ID_URL,
+    STOVE_LIVE_DATA_URL,
+    STOVE_NIGHT_LOWERING_OFF_URL,
+    STOVE_NIGHT_LOWERING_ON_URL,
+    STOVE_NIGHT_TIME_URL,
+    STOVE_OPEN_FILE_URL,
+    STOVE_READ_OPEN_FILE_URL,
+    STOVE_REMOTE_REFILL_ALARM_URL,
+    STOVE_SELFTEST_RESULT_URL,
+    STOVE_SELFTEST_START_URL,
+    STOVE_SET_TIME_URL,
+    STOVE_START_URL,
+    STOVE_WRITE_OPEN_FILE_URL,
+    YEAR,
+    OpenFileMode,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+INFO_XML = "<Info><Name>sim-1.0</Name><StoveType>Simulated</StoveType></Info>"
+
+SELF_TEST_KEYS = (
+    c.DATA_TEST_CONFIGURATION,
+    c.DATA_TEST_O2_SENSOR,
+    c.DATA_TEST_TEMP_SENSOR,
+    c.DATA_TEST_VALVE1,
+    c.DATA_TEST_VALVE2,
+    c.DATA_TEST_VALVE3,
+)
+
+
+def encode_live_data(temperatures, oxygen_levels):
+    """Encode values in the format returned by /get_live_data."""
+    out = bytearray()
+    for value in (*temperatures, *oxygen_levels):
+        n = int(round(value * 100))
+        out += bytes(((n >> 4) & 0xF, n & 0xF, (n >> 12) & 0xF, (n >> 8) & 0xF))
+    return out.decode("utf-8")
+
+
+class VirtualStove:
+    """A local stand-in for a stove, for tests and benchmarks.
+
+    Serves the stove's HTTP endpoints, including the raw file write
+    protocol, from in-memory state on a local TCP port.
+    """
+
+    def __init__(self, name="Virtual stove", mac_address=0x0A1B2C3D4E5F):
+        """Initialize the stove state."""
+        self.name = name
+        self.mac_address = mac_address
+        self.files = {FILENAME_INFO: INFO_XML.encode("utf-8")}
+        self.requests = 0
+        self.clock_offset = timedelta()
+        self.self_test_polls = None
+        self.data = {
+            c.DATA_ALGORITHM: "sim-1.0",
+            c.DATA_BURN_LEVEL: 3,
+            c.DATA_MAINTENANCE_ALARMS: 0,
+            c.DATA_MESSAGE_ID: 0,
+            c.DATA_NEW_FIREWOOD_HOURS: 1,
+            c.DATA_NEW_FIREWOOD_MINUTES: 30,
+            c.DATA_NIGHT_BEGIN_HOUR: 22,
+            c.DATA_NIGHT_BEGIN_MINUTE: 0,
+            c.DATA_NIGHT_END_HOUR: 7,
+            c.DATA_NIGHT_END_MINUTE: 0,
+            c.DATA_NIGHT_LOWERING: c.NightLoweringState.DISABLED,
+            c.DATA_OPERATION_MODE: c.OperationMode.NORMAL,
+            c.DATA_OXYGEN_LEVEL: 1200,
+            c.DATA_PHASE: c.BurnPhase.BURN,
+            c.DATA_REFILL_ALARM: 0,
+            c.DATA_REMOTE_REFILL_ALARM: 0,
+            c.DATA_REMOTE_VERSION_BUILD: 0,
+            c.DATA_REMOTE_VERSION_MAJOR: 1,
+            c.DATA_REMOTE_VERSION_MINOR: 0,
+            c.DATA_ROOM_TEMPERATURE: 2100,
+            c.DATA_SAFETY_ALARMS: 0,
+            c.DATA_STOVE_TEMPERATURE: 35000,
+            c.DATA_TIME_SINCE_REMOTE_MSG: 0,
+            c.DATA_UPDATING: 0,
+            c.DATA_VALVE1_POSITION: 50,
+            c.DATA_VALVE2_POSITION: 50,
+            c.DATA_VALVE3_POSITION: 50,
+            c.DATA_FIRMWARE_VERSION_BUILD: 0,
+            c.DATA_FIRMWARE_VERSION_MAJOR: 1,
+            c.DATA_FIRMWARE_VERSION_MINOR: 0,
+        }
+        self._open_file = None
+        self._server = None
+
+    @property
+    def address(self):
+        """Return the host:port to pass to Stove.create."""
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"{host}:{port}"
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving on host and port (0 picks a free port)."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def raw_data(self):
+        """Return the current /get_stove_data payload."""
+        now = datetime.now() + self.clock_offset
+        data = dict(self.data)
+        data.update(
+            {
+                YEAR: now.year,
+                MONTH: now.month,
+                DAY: now.day,
+                HOURS: now.hour,
+                MINUTES: now.minute,
+                SECONDS: now.second,
+            }
+        )
+        return data
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                method, path = lines[0].split()[:2]
+                if path == STOVE_WRITE_OPEN_FILE_URL:
+                    writer.write(await self._write_open_file(reader))
+                    await writer.drain()
+                    break
+                length = 0
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                body = await reader.readexactly(length) if length else b""
+                self.requests += 1
+                status, text = self._respond(method, path, body)
+                payload = text.encode("utf-8")
+                header = (
+                    f"HTTP/1.1 {status}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    "\r\n"
+                )
+                writer.write(header.encode("latin-1") + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _write_open_file(self, reader):
+        self.requests += 1
+        size, offset = struct.unpack("<HI", await reader.readexactly(6))
+        data = await reader.readexactly(size - 6)
+        if self._open_file is None or self._open_file[1] != OpenFileMode.WRITE:
+            return b"NO"
+        content = self.files.setdefault(self._open_file[0], b"")
+        if len(content) < offset:
+            content += b"\0" * (offset - len(content))
+        self.files[self._open_file[0]] = (
+            content[:offset] + data + content[offset + len(data) :]
+        )
+        return b"OK"
+
+    def _respond(self, method, path, body):
+        try:
+            request = json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            return "400 Bad Request", ""
+        ok = json.dumps({KEY_RESPONSE: RESPONSE_OK})
+        if path == STOVE_DATA_URL:
+            return "200 OK", json.dumps(self.raw_data())
+        if path == STOVE_LIVE_DATA_URL:
+            temperature = self.data[c.DATA_STOVE_TEMPERATURE] / 100
+            oxygen = self.data[c.DATA_OXYGEN_LEVEL] / 100
+            return "200 OK", encode_live_data([temperature] * 120, [oxygen] * 120)
+        if path == STOVE_ID_URL:
+            return "200 OK", json.dumps(
+                {
+                    IDENT_NAME: self.name,
+                    IDENT_IP: "127.0.0.1",
+                    IDENT_MDNS: f"ihs_{self.mac_address:012x}",
+                }
+            )
+        if path == STOVE_ACCESSPOINT_URL:
+            return "200 OK", json.dumps({IDENT_SSID: "simulated"})
+        if path == STOVE_BURN_LEVEL_URL:
+            self.data[c.DATA_BURN_LEVEL] = request[KEY_LEVEL]
+            return "200 OK", ok
+        if path == STOVE_NIGHT_LOWERING_ON_URL:
+            self.data[c.DATA_NIGHT_LOWERING] = c.NightLoweringState.DAY
+            return "200 OK", ok
+        if path == STOVE_NIGHT_LOWERING_OFF_URL:
+            self.data[c.DATA_NIGHT_LOWERING] = c.NightLoweringState.DISABLED
+            return "200 OK", ok
+        if path == STOVE_NIGHT_TIME_URL:
+            self.data[c.DATA_NIGHT_BEGIN_HOUR] = request[c.DATA_BEGIN_HOUR]
+            self.data[c.DATA_NIGHT_BEGIN_MINUTE] = request[c.DATA_BEGIN_MINUTE]
+            self.data[c.DATA_NIGHT_END_HOUR] = request[c.DATA_END_HOUR]
+            self.data[c.DATA_NIGHT_END_MINUTE] = request[c.DATA_END_MINUTE]
+            return "200 OK", ok
+        if path == STOVE_REMOTE_REFILL_ALARM_URL:
+            self.data[c.DATA_REMOTE_REFILL_ALARM] = request[KEY_ENABLE]
+            return "200 OK", ok
+        if path == STOVE_SET_TIME_URL:
+            new_time = datetime(
+                request[YEAR],
+                request[MONTH] + 1,  # Stove month input is 0 based.
+                request[DAY],
+                request[HOURS],
+                request[MINUTES],
+                request[SECONDS],
+            )
+            self.clock_offset = new_time - datetime.now()
+            return "200 OK", ok
+        if path == STOVE_START_URL:
+            self.data[c.DATA_PHASE] = c.BurnPhase.IGNITION
+            return "200 OK", ok
+        if path == STOVE_SELFTEST_START_URL:
+            self.self_test_polls = 0
+            return "200 OK", ok
+        if path == STOVE_SELFTEST_RESULT_URL:
+            return "200 OK", json.dumps(self._self_test_result())
+        if path == STOVE_OPEN_FILE_URL:
+            name, mode = request[FILE_NAME], request[FILE_MODE]
+            if mode == OpenFileMode.READ and name not in self.files:
+                return "200 OK", json.dumps({RESPONSE_SUCCESS: 0})
+            self._open_file = (name, mode)
+            size = len(self.files.get(name, b""))
+            return "200 OK", json.dumps({RESPONSE_SUCCESS: 1, FILE_SIZE: size})
+        if path == STOVE_READ_OPEN_FILE_URL:
+            if self._open_file is None:
+                return "200 OK", ""
+            return "200 OK", self.files[self._open_file[0]].decode("utf-8")
+        if path == STOVE_CLOSE_FILE_URL:
+            self._open_file = None
+            return "200 OK", ok
+        if path == STOVE_DELETE_FILE_URL:
+            self.files.pop(request.get(FILE_NAME), None)
+            return "200 OK", ok
+        return "404 Not Found", ""
+
+    def _self_test_result(self):
+        if self.self_test_polls is None:
+            state = c.SelfTestState.NOT_STARTED
+        else:
+            self.self_test_polls += 1
+            state = (
+                c.SelfTestState.RUNNING
+                if self.self_test_polls < 3
+                else c.SelfTestState.PASSED
+            )
+        return {key: state for key in SELF_TEST_KEYS}
+
+
+class LocalBroker:
+    """A local stand-in for an MQTT broker, for tests and benchmarks.
+
+    Accepts QoS 0 publishes from any number of clients and records them.
+    """
+
+    def __init__(self):
+        """Initialize the broker state."""
+        self.messages = []
+        self.retained = {}
+        self.connections = 0
+        self._server = None
+
+    @property
+    def address(self):
+        """Return the host:port to pass to MqttConnection."""
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"{host}:{port}"
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving on host and port (0 picks a free port)."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            header, _ = await read_packet(reader)
+            if header != PACKET_CONNECT:
+                return
+            self.connections += 1
+            writer.write(bytes((PACKET_CONNACK, 2, 0, 0)))
+            while True:
+                header, body = await read_packet(reader)
+                kind = header & 0xF0
+                if kind == PACKET_PUBLISH:
+                    length = int.from_bytes(body[:2], "big")
+                    topic = body[2 : 2 + length].decode("utf-8")
+                    payload = body[2 + length :]
+                    retain = bool(header & PUBLISH_RETAIN)
+                    self.messages.append((topic, payload, retain))
+                    if retain:
+                        self.retained[topic] = payload
+                elif kind == PACKET_PINGREQ:
+                    writer.write(bytes((PACKET_PINGRESP, 0)))
+                elif kind == PACKET_DISCONNECT:
+                    return
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,237 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+from bisect import bisect_right
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+
+_LOGGER = logging.getLogger(__name__)
+
+# Snapshot log file format: a sequence of independent segments. Every
+# segment has a header (first timestamp, last timestamp, compressed
+# length) followed by zlib compressed JSON lines. The first line of a
+# segment is a keyframe with the full raw data, every following line
+# only holds the fields that changed since the previous snapshot. Changed
+# integers are stored as the difference to their previous value, which
+# compresses well for counters and slowly changing temperatures. Times
+# in delta lines are seconds since the keyframe at full precision. The
+# difference of two nearby timestamps is exact, so adding it to the
+# keyframe time gives back the original timestamp.
+SEGMENT_HEADER = struct.Struct(">ddI")
+
+SNAP_CHANGED = "c"
+SNAP_DATA = "k"
+SNAP_DIFF = "n"
+SNAP_REMOVED = "r"
+SNAP_TIME = "t"
+
+_JSON_SEPARATORS = (",", ":")
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _delta(previous, data):
+    """Return a delta entry that turns previous into data."""
+    changed = {}
+    diff = {}
+    for key, value in data.items():
+        if key in previous and previous[key] == value:
+            continue
+        if key in previous and _is_int(value) and _is_int(previous[key]):
+            diff[key] = value - previous[key]
+        else:
+            changed[key] = value
+    entry = {}
+    if changed:
+        entry[SNAP_CHANGED] = changed
+    if diff:
+        entry[SNAP_DIFF] = diff
+    removed = [key for key in previous if key not in data]
+    if removed:
+        entry[SNAP_REMOVED] = removed
+    return entry
+
+
+def _apply(data, entry):
+    """Apply a delta entry to data in place."""
+    data.update(entry.get(SNAP_CHANGED, ()))
+    for key, value in entry.get(SNAP_DIFF, {}).items():
+        data[key] += value
+    for key in entry.get(SNAP_REMOVED, ()):
+        del data[key]
+
+
+def _decode_segment(blob):
+    """Yield (timestamp, data) tuples of a compressed segment."""
+    data = None
+    for line in zlib.decompress(blob).splitlines():
+        entry = json.loads(line)
+        if data is None:
+            data = entry[SNAP_DATA]
+            first = entry[SNAP_TIME]
+            yield first, dict(data)
+        else:
+            _apply(data, entry)
+            yield first + entry[SNAP_TIME], dict(data)
+
+
+class SnapshotWriter:
+    """Append raw stove data snapshots to a delta compressed log.
+
+    A new keyframe is started every keyframe_interval snapshots. Times
+    are read back exactly as they were appended. The current segment is
+    kept in memory until it is complete or flush() is called, so a crash
+    loses at most keyframe_interval snapshots.
+    """
+
+    def __init__(self, path, keyframe_interval=300):
+        """Open path for appending."""
+        self.keyframe_interval = keyframe_interval
+        self._file = open(path, "ab")  # noqa: SIM115
+        self._lines = []
+        self._previous = None
+        self._first = None
+        self._last = None
+
+    def append(self, data, timestamp=None):
+        """Add a raw data snapshot, timestamp defaults to now."""
+        timestamp = time.time() if timestamp is None else timestamp
+        if self._previous is None:
+            entry = {SNAP_DATA: data, SNAP_TIME: timestamp}
+            self._first = timestamp
+        else:
+            entry = _delta(self._previous, data)
+            entry[SNAP_TIME] = timestamp - self._first
+        self._lines.append(json.dumps(entry, separators=_JSON_SEPARATORS))
+        self._previous = dict(data)
+        self._last = timestamp
+        if len(self._lines) >= self.keyframe_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the current segment, the next snapshot starts a keyframe."""
+        if not self._lines:
+            return
+        blob = zlib.compress("\n".join(self._lines).encode("utf-8"), 9)
+        self._file.write(SEGMENT_HEADER.pack(self._first, self._last, len(blob)))
+        self._file.write(blob)
+        self._file.flush()
+        self._lines = []
+        self._previous = None
+
+    def close(self):
+        """Flush the current segment and close the file."""
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SnapshotReader:
+    """Random access to a snapshot log.
+
+    Opening the log only reads the segment headers. Looking up a point
+    in time decompresses a single segment.
+    """
+
+    def __init__(self, path):
+        """Open path and index its segments."""
+        self._file = open(path, "rb")  # noqa: SIM115
+        size = os.fstat(self._file.fileno()).st_size
+        self._starts = []
+        self._segments = []
+        while True:
+            header = self._file.read(SEGMENT_HEADER.size)
+            if len(header) < SEGMENT_HEADER.size:
+                break
+            first, last, length = SEGMENT_HEADER.unpack(header)
+            offset = self._file.tell()
+            if offset + length > size:
+                _LOGGER.warning("Ignoring truncated segment at offset %s.", offset)
+                break
+            self._file.seek(length, 1)
+            self._starts.append(first)
+            self._segments.append((first, last, offset, length))
+        self._cache = (None, None)
+
+    def __len__(self):
+        """Return the number of segments."""
+        return len(self._segments)
+
+    @property
+    def start(self):
+        """Return the timestamp of the first snapshot, None if empty."""
+        return self._segments[0][0] if self._segments else None
+
+    @property
+    def end(self):
+        """Return the timestamp of the last snapshot, None if empty."""
+        return self._segments[-1][1] if self._segments else None
+
+    def _segment(self, index):
+        """Return the decoded snapshots of segment index."""
+        if self._cache[0] != index:
+            _, _, offset, length = self._segments[index]
+            self._file.seek(offset)
+            self._cache = (index, list(_decode_segment(self._file.read(length))))
+        return self._cache[1]
+
+    def at(self, timestamp):
+        """Return the (timestamp, data) snapshot at or before timestamp.
+
+        Returns None if timestamp is before the first snapshot.
+        """
+        index = bisect_right(self._starts, timestamp) - 1
+        if index < 0:
+            return None
+        snapshots = self._segment(index)
+        position = bisect_right([t for t, _ in snapshots], timestamp) - 1
+        return snapshots[position]
+
+    def range(self, start=None, end=None):
+        """Yield (timestamp, data) snapshots from start up to and including end."""
+        first = 0 if start is None else max(bisect_right(self._starts, start) - 1, 0)
+        for index in range(first, len(self._segments)):
+            if end is not None and self._segments[index][0] > end:
+                return
+            for timestamp, data in self._segment(index):
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    return
+                yield timestamp, data
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
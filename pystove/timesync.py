@@ -0,0 +1,125 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+from datetime import datetime, timedelta
+import logging
+import time
+
+import aiohttp
+
+from .pystove import raw_datetime
+
+_LOGGER = logging.getLogger(__name__)
+
+# The stove reports whole seconds, on average it is half a second further.
+_HALF_SECOND = timedelta(seconds=0.5)
+
+
+class DriftResult:
+    """Clock drift of a stove before and after synchronization."""
+
+    def __init__(self, stove):
+        """Initialize an empty result for stove."""
+        self.stove = stove
+        self.drift = None
+        self.rtt = None
+        self.corrected = False
+        self.drift_after = None
+        self.error = None
+
+    def __repr__(self):
+        return (
+            f"<DriftResult {self.stove.stove_host} drift={self.drift}"
+            f" rtt={self.rtt} corrected={self.corrected}"
+            f" drift_after={self.drift_after} error={self.error}>"
+        )
+
+
+async def measure_drift(stove):
+    """Return a (drift, rtt) tuple for stove.
+
+    Drift is a timedelta of stove time minus local time, compensated for
+    half of the round trip time of the request, which is returned in
+    seconds. The stove reports whole seconds, so a single measurement is
+    accurate to about half a second. Returns (None, rtt) if the stove did
+    not respond.
+    """
+    now = datetime.now()
+    start = time.monotonic()
+    # Do not join a request that started before now, its time is stale.
+    data = await stove._shared_raw_data(since=asyncio.get_running_loop().time())
+    rtt = time.monotonic() - start
+    if not data:
+        return None, rtt
+    local_time = now + timedelta(seconds=rtt / 2)
+    return raw_datetime(data) + _HALF_SECOND - local_time, rtt
+
+
+async def sync_time(stove, threshold=timedelta(seconds=5)):
+    """Set the stove clock if it drifted more than threshold.
+
+    The new time is sent so that it arrives, estimated from the measured
+    round trip time, exactly on a whole second. Returns a DriftResult.
+    """
+    result = DriftResult(stove)
+    await _sync_time(stove, threshold, result)
+    return result
+
+
+async def _sync_time(stove, threshold, result):
+    """Synchronize the stove clock, filling in result as it goes."""
+    result.drift, result.rtt = await measure_drift(stove)
+    if result.drift is None:
+        result.error = "No response from stove"
+        return
+    if abs(result.drift) <= threshold:
+        return
+    one_way = timedelta(seconds=result.rtt / 2)
+    arrival = datetime.now() + one_way
+    await asyncio.sleep(1 - arrival.microsecond / 1000000)
+    new_time = (datetime.now() + one_way + _HALF_SECOND).replace(microsecond=0)
+    if not await stove.set_time(new_time):
+        result.error = "Setting time failed"
+        return
+    result.corrected = True
+    result.drift_after, _ = await measure_drift(stove)
+
+
+async def sync_fleet(stoves, threshold=timedelta(seconds=5), concurrency=16):
+    """Synchronize the clocks of many stoves, return a list of DriftResult.
+
+    A failing stove does not affect the others, its error is recorded in
+    its result.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def sync(stove):
+        result = DriftResult(stove)
+        async with semaphore:
+            try:
+                await _sync_time(stove, threshold, result)
+            except (aiohttp.ClientError, OSError, ValueError) as exc:
+                _LOGGER.exception("%s: synchronizing time failed.", stove.stove_host)
+                result.error = f"Synchronizing time failed: {exc!r}"
+                return result
+            if result.error:
+                _LOGGER.warning("%s: %s", stove.stove_host, result.error)
+            return result
+
+    return await asyncio.gather(*[sync(stove) for stove in stoves])
@@ -0,0 +1,74 @@
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+#
+
+import asyncio
+import contextlib
+from urllib.parse import urlsplit
+
+import aiohttp
+
+HTTP_HEADERS = {"Accept": "application/json"}
+
+
+def split_host(host, default_port=80):
+    """Split a host[:port] string into a (hostname, port) tuple."""
+    parts = urlsplit("//" + host)
+    return parts.hostname, parts.port or default_port
+
+
+class HttpTransport:
+    """Transport that talks to the stove over the network.
+
+    A transport provides get(), post() and write() coroutines. Stove uses
+    these for all communication, so other transports can be swapped in
+    for e.g. recording or replaying traffic.
+    """
+
+    def __init__(self, session=None):
+        """Initialize the transport, optionally with a shared session."""
+        self._owns_session = session is None
+        self._session = session or aiohttp.ClientSession(headers=HTTP_HEADERS)
+
+    async def get(self, url):
+        """Get data from url, return response text."""
+        async with self._session.get(url) as response:
+            return await response.text()
+
+    async def post(self, url, body):
+        """Post body to url, return response text."""
+        async with self._session.post(url, data=body) as response:
+            return await response.text()
+
+    async def write(self, host, request):
+        """Send a raw request to host, return the 2 byte response."""
+        writer = None
+        try:
+            reader, writer = await asyncio.open_connection(*split_host(host))
+            writer.write(request)
+            await writer.drain()
+            return await reader.read(2)
+        finally:
+            if writer is not None:
+                writer.close()
+                with contextlib.suppress(OSError):
+                    await writer.wait_closed()
+
+    async def close(self):
+        """Close the transport."""
+        if self._owns_session:
+            await self._session.close()
@@ -24,7 +24,6 @@ import sys
 
 from pystove.const import (
     DATA_BURN_LEVEL,
-    DATA_DATE_TIME,
     DATA_NIGHT_BEGIN_TIME,
     DATA_NIGHT_END_TIME,
     DATA_NIGHT_LOWERING,
@@ -39,7 +38,7 @@ from pystove.const import (
     DATA_TEST_VALVE3,
     SelfTestState,
 )
-from pystove.pystove import Stove
+from pystove.pystove import Stove, process_raw_data, raw_datetime
 from pystove.version import __version__
 
 
@@ -113,12 +112,11 @@ async def run_command(stove_host, command, value):
                 print(f"Invalid value: {value}")
                 return
             if 0 <= value <= 5:
-                if await stv.set_burn_level(value):
-                    result = await stv.get_data()
-                    if result:
-                        print(f"Burn level set to {result[DATA_BURN_LEVEL]}.")
-                    else:
-                        print("Unable to confirm success.")
+                result = await stv.set_burn_level_and_confirm(value)
+                if result:
+                    print(f"Burn level set to {result[DATA_BURN_LEVEL]}.")
+                elif result is None:
+                    print("Unable to confirm success.")
                 else:
                     print("Setting burn level failed!")
             else:
@@ -126,16 +124,15 @@ async def run_command(stove_host, command, value):
         elif command == "set_night_lowering":
             if value is not None:
                 value = value.lower() in ("1", "on")
-            if await stv.set_night_lowering(value):
-                result = await stv.get_raw_data()
-                if result:
-                    print(
-                        "Night lowering switched {}.".format(
-                            "on" if result[DATA_NIGHT_LOWERING] else "off"
-                        )
+            result = await stv.set_night_lowering_and_confirm(value)
+            if result:
+                print(
+                    "Night lowering switched {}.".format(
+                        "on" if result[DATA_NIGHT_LOWERING] else "off"
                     )
-                else:
-                    print("Unable to confirm success.")
+                )
+            elif result is None:
+                print("Unable to confirm success.")
             else:
                 print("Setting night lowering failed.")
         elif command == "set_night_lowering_hours":
@@ -161,29 +158,30 @@ async def run_command(stove_host, command, value):
                 span[k] = int(v)
             start = time(hour=span["start_hr"], minute=span["start_min"])
             end = time(hour=span["end_hr"], minute=span["end_min"])
-            if await stv.set_night_lowering_hours(start=start, end=end):
-                result = await stv.get_data()
-                if result:
-                    print("Night lowering hours set.")
-                    print(f"Start: {result[DATA_NIGHT_BEGIN_TIME]}")
-                    print(f"End: {result[DATA_NIGHT_END_TIME]}")
-                else:
-                    print("Unable to confirm success.")
+            result = await stv.set_night_lowering_hours_and_confirm(
+                start=start, end=end
+            )
+            if result:
+                result = process_raw_data(result)
+                print("Night lowering hours set.")
+                print(f"Start: {result[DATA_NIGHT_BEGIN_TIME]}")
+                print(f"End: {result[DATA_NIGHT_END_TIME]}")
+            elif result is None:
+                print("Unable to confirm success.")
             else:
                 print("Setting night lowering hours failed.")
         elif command == "set_remote_refill_alarm":
             if value is not None:
                 value = value.lower() in ("1", "on")
-            if await stv.set_remote_refill_alarm(value):
-                result = await stv.get_raw_data()
-                if result:
-                    print(
-                        "Remote refill alarm switched {}.".format(
-                            "on" if result[DATA_REMOTE_REFILL_ALARM] else "off"
-                        )
+            result = await stv.set_remote_refill_alarm_and_confirm(value)
+            if result:
+                print(
+                    "Remote refill alarm switched {}.".format(
+                        "on" if result[DATA_REMOTE_REFILL_ALARM] else "off"
                     )
-                else:
-                    print("Unable to confirm success.")
+                )
+            elif result is None:
+                print("Unable to confirm success.")
             else:
                 print("Setting remote refill alarm failed.")
         elif command == "set_time":
@@ -195,12 +193,11 @@ async def run_command(stove_host, command, value):
                     return
             else:
                 new_time = datetime.now()
-            if await stv.set_time(new_time):
-                result = await stv.get_data()
-                if result:
-                    print(f"Stove time set to {result[DATA_DATE_TIME]}")
-                else:
-                    print("Unable to verify success.")
+            result = await stv.set_time_and_confirm(new_time)
+            if result:
+                print(f"Stove time set to {raw_datetime(result)}")
+            elif result is None:
+                print("Unable to verify success.")
             else:
                 print("Failed to set the time on the stove.")
         elif command == "show_info":
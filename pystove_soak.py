@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# This file is part of pystove.
+#
+# pystove is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pystove is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pystove.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 Milan van Nugteren
+
+import asyncio
+import gc
+import os
+import sys
+import tracemalloc
+
+from pystove.pystove import Stove
+from pystove.simulator import VirtualStove
+
+
+def rss_bytes():
+    """Return the resident set size of this process, None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+async def poll_once(stove):
+    """Run every polled code path once against a stove."""
+    await stove.get_data()
+    await stove.get_live_data()
+    await stove._identify()
+    async for _ in stove.self_test(delay=0):
+        pass
+    await stove.write_text_file("soak.txt", "soak" * 300)
+
+
+async def run_soak(stoves=20, iterations=100, warmup=10, budget=16, rss_budget=256):
+    """Poll virtual stoves in a loop and check memory growth per stove.
+
+    Growth is measured between the end of the warmup iterations and the
+    end of the run. Budgets are in KiB per stove. Returns True if memory
+    growth stayed within both budgets.
+    """
+    virtual_stoves = [
+        VirtualStove(name=f"soak-{i}", mac_address=i) for i in range(stoves)
+    ]
+    for virtual_stove in virtual_stoves:
+        await virtual_stove.start()
+    clients = [await Stove.create(v.address) for v in virtual_stoves]
+
+    async def run(count):
+        for _ in range(count):
+            await asyncio.gather(*[poll_once(client) for client in clients])
+
+    tracemalloc.start()
+    try:
+        await run(warmup)
+        gc.collect()
+        start_snapshot = tracemalloc.take_snapshot()
+        start_traced = tracemalloc.get_traced_memory()[0]
+        start_rss = rss_bytes()
+
+        await run(iterations)
+        gc.collect()
+        end_snapshot = tracemalloc.take_snapshot()
+        end_traced = tracemalloc.get_traced_memory()[0]
+        end_rss = rss_bytes()
+    finally:
+        tracemalloc.stop()
+        for client in clients:
+            await client.destroy()
+        for virtual_stove in virtual_stoves:
+            await virtual_stove.stop()
+
+    traced_growth = (end_traced - start_traced) / stoves / 1024
+    print(f"Stoves: {stoves}, iterations: {iterations} (after {warmup} warmup)")
+    print(f"Traced growth:\t{traced_growth:8.2f} KiB per stove (budget {budget})")
+    success = traced_growth <= budget
+    if start_rss is not None and end_rss is not None:
+        rss_growth = (end_rss - start_rss) / stoves / 1024
+        print(f"RSS growth:\t{rss_growth:8.2f} KiB per stove (budget {rss_budget})")
+        success = success and rss_growth <= rss_budget
+    if not success:
+        print()
+        print("Largest allocation growth:")
+        for stat in end_snapshot.compare_to(start_snapshot, "lineno")[:10]:
+            print(stat)
+    return success
+
+
+if __name__ == "__main__":
+    """Handle direct invocation from command line."""
+    import getopt
+
+    def print_help():
+        """Print help message."""
+        print(f"Usage: {sys.argv[0]} <options>")
+        print()
+        print("Poll local virtual stoves and fail if memory grows past a budget.")
+        print()
+        print("Options:")
+        print()
+        print("  -s, --stoves <COUNT>\t\tNumber of virtual stoves (default 20)")
+        print("  -i, --iterations <COUNT>\tMeasured iterations (default 100)")
+        print("  -w, --warmup <COUNT>\t\tIterations before measuring (default 10)")
+        print("  -b, --budget <KIB>\t\tTraced growth per stove (default 16)")
+        print("  -r, --rss-budget <KIB>\tRSS growth per stove (default 256)")
+        print()
+        sys.exit()
+
+    kwargs = {}
+    options = {
+        ("-s", "--stoves"): "stoves",
+        ("-i", "--iterations"): "iterations",
+        ("-w", "--warmup"): "warmup",
+        ("-b", "--budget"): "budget",
+        ("-r", "--rss-budget"): "rss_budget",
+    }
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            "hs:i:w:b:r:",
+            ["help", "stoves=", "iterations=", "warmup=", "budget=", "rss-budget="],
+        )
+    except getopt.GetoptError:
+        print_help()
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print_help()
+        for names, key in options.items():
+            if opt in names:
+                kwargs[key] = int(arg)
+    sys.exit(0 if asyncio.run(run_soak(**kwargs)) else 1)
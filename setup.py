@@ -23,7 +23,7 @@ setup(
     long_description=read("README.md"),
     long_description_content_type="text/markdown",
     install_requires=[
-        "aiohttp",
+        "aiohttp>=3.11",
         "defusedxml",
     ],
     classifiers=[